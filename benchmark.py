@@ -0,0 +1,458 @@
+"""Database benchmark for Taina Poshta Bot.
+
+Seeds a dedicated PostgreSQL database with synthetic users and threaded
+messages, then times each Database method under single-client and
+concurrent load and prints p50/p95/p99 latency and throughput as JSON.
+
+    python benchmark.py --database-url postgresql://localhost/taina_bench \\
+        --users 10000 --messages 5000000 --thread-depth 20 --output bench.json
+
+With --mode startup it instead starts the bot in fresh processes against an
+existing database, posts one update to each and reports how long after process
+start it was imported, answered the update (time to first response) and ready:
+
+    python benchmark.py --database-url postgresql://localhost/taina_bench --mode startup --startup-runs 10
+
+Never point it at production: seeding TRUNCATEs the bot's tables.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import logging
+import platform
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+logger = logging.getLogger('benchmark')
+
+# Rows inserted per statement while seeding
+SEED_CHUNK = 100_000
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def seed(db, users: int, messages: int, thread_depth: int, days: int, approved_ratio: float):
+    """Replace the bot's data with `users` users and `messages` messages in threads of `thread_depth`"""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE users, messages, daily_stats RESTART IDENTITY CASCADE")
+            logger.info(f"Seeding {users} users")
+            cur.execute(
+                """
+                INSERT INTO users (user_id, first_name, last_name, username, approved, created_at)
+                SELECT g,
+                       'Name' || (g %% 997),
+                       'Surname' || (g %% 1009),
+                       'user' || g,
+                       random() < %s,
+                       NOW() - random() * make_interval(days => %s)
+                FROM generate_series(1, %s) g
+                """,
+                (approved_ratio, days, users)
+            )
+            conn.commit()
+
+    # Messages are spread over `days` of history; every month needs its partition
+    db.ensure_message_partitions(since=date.today() - timedelta(days=days + 1))
+
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            # Message g is at position (g - 1) %% depth of its thread: each reply points at the
+            # previous message and every message stores the thread's first message as root
+            for start in range(1, messages + 1, SEED_CHUNK):
+                end = min(start + SEED_CHUNK - 1, messages)
+                cur.execute(
+                    """
+                    INSERT INTO messages (message_id, sender_id, recipient_id, message_text, thread_id,
+                                          root_id, created_at, delivery_status, next_attempt_at, delivered_at)
+                    SELECT g,
+                           1 + (hashint %% %(users)s),
+                           1 + ((hashint + 1 + (g %% (%(users)s - 1))) %% %(users)s),
+                           'Benchmark message ' || g,
+                           CASE WHEN (g - 1) %% %(depth)s = 0 THEN NULL ELSE g - 1 END,
+                           g - (g - 1) %% %(depth)s,
+                           ts,
+                           'delivered',
+                           NULL,
+                           ts
+                    FROM (
+                        SELECT g,
+                               abs(hashtext((g - (g - 1) %% %(depth)s)::text)) AS hashint,
+                               NOW() - make_interval(secs => (%(messages)s - g) * %(spacing)s) AS ts
+                        FROM generate_series(%(start)s, %(end)s) g
+                    ) s
+                    """,
+                    {
+                        'users': users,
+                        'depth': thread_depth,
+                        'messages': messages,
+                        'spacing': days * 86400.0 / max(messages, 1),
+                        'start': start,
+                        'end': end,
+                    }
+                )
+                conn.commit()
+                logger.info(f"Seeded messages {start}-{end}")
+
+            cur.execute(
+                "SELECT setval(pg_get_serial_sequence('messages', 'message_id'), GREATEST(%s, 1))",
+                (messages,)
+            )
+            conn.commit()
+            cur.execute("ANALYZE users")
+            cur.execute("ANALYZE messages")
+            conn.commit()
+
+
+def scenarios(db, users: int, messages: int, page_size: int, write_batch: int):
+    """Name -> zero-argument callable performing one operation"""
+    rand = random.Random()
+
+    def user_id():
+        return rand.randint(1, users)
+
+    def message_id():
+        return rand.randint(1, max(messages, 1))
+
+    # (message_id, created_at) pairs for lookups that carry the partition key, as the bot's buttons do
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT message_id, created_at FROM messages WHERE message_id = ANY(%s)",
+                ([message_id() for _ in range(1000)],)
+            )
+            keyed = [(row['message_id'], row['created_at']) for row in cur.fetchall()] or [(1, None)]
+
+    def get_user_uncached():
+        uid = user_id()
+        db.user_cache.invalidate(uid)
+        db.get_user(uid)
+
+    def get_stats_uncached():
+        db._stats_cache = None
+        db.get_stats()
+
+    return {
+        'get_user': get_user_uncached,
+        'get_user_cached': lambda: db.get_user(user_id() % 100 + 1),
+        'save_message': lambda: db.save_message(user_id(), user_id(), 'Benchmark', None),
+        'save_reply': lambda: db.save_message(user_id(), user_id(), 'Benchmark reply', message_id()),
+        # One call writes `write_batch` messages; compare throughput x write_batch with save_message
+        'save_messages_batch': lambda: db.save_messages(
+            [(user_id(), user_id(), 'Benchmark', None) for _ in range(write_batch)]),
+        'get_message': lambda: db.get_message(message_id()),
+        'get_thread_starter': lambda: db.get_thread_starter(message_id()),
+        'get_thread_starter_keyed': lambda: db.get_thread_starter(*rand.choice(keyed)),
+        'get_approved_users_page': lambda: db.get_approved_users_page(
+            exclude_user_id=user_id(), after_user_id=user_id(), limit=page_size),
+        'get_users_page': lambda: db.get_users_page(after_user_id=user_id(), limit=page_size),
+        'get_stats': get_stats_uncached,
+        'get_total_users': db.get_total_users,
+        'get_approved_count': db.get_approved_count,
+        'get_total_messages': db.get_total_messages,
+        'get_messages_last_week': db.get_messages_last_week,
+        'get_messages_today': db.get_messages_today,
+    }
+
+
+def measure(operation, iterations: int, concurrency: int, warmup: int):
+    """Run `operation` `iterations` times on `concurrency` threads; returns latency/throughput stats"""
+    for _ in range(warmup):
+        operation()
+
+    def worker(count):
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    shares = [iterations // concurrency + (1 if i < iterations % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(l for result in executor.map(worker, shares) for l in result)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'iterations': len(latencies),
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 4),
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+# The update posted to the freshly started bot in startup mode, and who sends it
+STARTUP_CHAT_ID = 1
+STARTUP_WEBHOOK_SECRET = 'startup-benchmark'
+
+
+def startup_update(chat_id: int) -> bytes:
+    """A /help message from `chat_id`, as Telegram would post it to the webhook"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'}
+    return json.dumps({
+        'update_id': 1,
+        'message': {
+            'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+            'from': user, 'text': '/help', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}],
+        },
+    }).encode()
+
+
+def startup_child():
+    """One cold start, run in a fresh process; prints milestones in ms since the process started as JSON.
+
+    The bot runs in webhook mode with Bot API calls answered in-process, so the
+    measurement covers everything up to the reply but not Telegram's latency.
+    """
+    import asyncio
+    import signal
+    from telegram.request import BaseRequest
+    from metrics import process_uptime
+
+    timings = {}
+
+    def mark(name):
+        timings.setdefault(f'{name}_ms', round(process_uptime() * 1000, 3))
+
+    class LocalBotAPI(BaseRequest):
+        """Answers Bot API calls locally and notes when the update's reply is sent"""
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                             connect_timeout=None, pool_timeout=None):
+            endpoint = url.rsplit('/', 1)[-1]
+            parameters = request_data.parameters if request_data else {}
+            if endpoint == 'getMe':
+                result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+            elif endpoint == 'sendMessage':
+                if parameters.get('chat_id') == STARTUP_CHAT_ID:
+                    mark('first_response')
+                    responded.set()
+                result = {
+                    'message_id': 1, 'date': int(time.time()), 'text': parameters.get('text', ''),
+                    'chat': {'id': parameters.get('chat_id'), 'type': 'private'},
+                }
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    async def post_update(port):
+        """POST the update to the webhook as soon as it accepts connections"""
+        body = startup_update(STARTUP_CHAT_ID)
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                break
+            except OSError:
+                await asyncio.sleep(0.005)
+        writer.write(
+            f"POST {bot_module.WEBHOOK_PATH} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {STARTUP_WEBHOOK_SECRET}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        status = (await reader.readline()).decode().split()
+        writer.close()
+        if status[1:2] != ['200']:
+            raise RuntimeError(f"Webhook refused the update: {' '.join(status)}")
+        mark('update_posted')
+
+    async def run():
+        serving = asyncio.create_task(bot._serve())
+        await post_update(bot_module.WEBHOOK_PORT)
+        waiting = asyncio.create_task(responded.wait())
+        await asyncio.wait([serving, waiting], return_when=asyncio.FIRST_COMPLETED)
+        if serving.done():
+            serving.result()
+            raise RuntimeError("The bot stopped before answering the update")
+        while not bot.ready:
+            await asyncio.sleep(0.005)
+        mark('ready')
+        # Shut down the way SIGTERM would
+        os.kill(os.getpid(), signal.SIGTERM)
+        await serving
+
+    # The bot module pulls in python-telegram-bot and everything the bot imports at startup
+    import bot as bot_module
+    mark('imported')
+    responded = asyncio.Event()
+    bot = bot_module.TainaPoshtaBot('1:STARTUP', request=LocalBotAPI())
+    try:
+        asyncio.run(run())
+    finally:
+        bot.db.close()
+    print(json.dumps(timings))
+
+
+def free_port() -> int:
+    """A TCP port nothing listens on right now"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_startup(database_url: str, runs: int):
+    """Start `runs` fresh bots one after another; median and max ms from process start to each milestone"""
+    env = dict(
+        os.environ, DATABASE_URL=database_url, BOT_MODE='webhook', WEBHOOK_URL='http://127.0.0.1',
+        WEBHOOK_LISTEN='127.0.0.1', WEBHOOK_SECRET=STARTUP_WEBHOOK_SECRET, MULTI_INSTANCE='',
+    )
+    for name in ('METRICS_PORT', 'HEALTH_PORT'):
+        env.pop(name, None)
+    samples = []
+    for run in range(runs):
+        logger.info(f"Cold start {run + 1}/{runs}")
+        started = time.perf_counter()
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--startup-child'],
+            env=dict(env, PORT=str(free_port())), capture_output=True, text=True, check=True,
+        )
+        sample = json.loads(child.stdout.strip().splitlines()[-1])
+        sample['spawn_to_exit_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        samples.append(sample)
+
+    results = {}
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples)
+        results[key] = {'p50': percentile(values, 0.50), 'max': values[-1]}
+    return {'runs': runs, 'milestones': results}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help="Dedicated benchmark database (default: $BENCH_DATABASE_URL)")
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--thread-depth', type=int, default=10, help="Messages per conversation thread")
+    parser.add_argument('--days', type=int, default=365, help="History the messages are spread over")
+    parser.add_argument('--approved-ratio', type=float, default=0.9)
+    parser.add_argument('--skip-seed', action='store_true', help="Reuse data seeded by an earlier run")
+    parser.add_argument('--iterations', type=int, default=500, help="Operations per scenario and load level")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8, help="Client threads for the concurrent run")
+    parser.add_argument('--page-size', type=int, default=10)
+    parser.add_argument('--write-batch', type=int, default=50, help="Messages per save_messages_batch call")
+    parser.add_argument('--only', nargs='*', help="Run only these scenarios")
+    parser.add_argument('--mode', choices=('queries', 'startup'), default='queries',
+                        help="Time database methods, or cold starts of fresh processes")
+    parser.add_argument('--startup-runs', type=int, default=5, help="Cold starts to measure in startup mode")
+    parser.add_argument('--startup-child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.startup_child:
+        startup_child()
+        return
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    if not args.database_url:
+        sys.exit("Set --database-url or BENCH_DATABASE_URL to a dedicated benchmark database")
+    if args.mode == 'startup':
+        report = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'startup': measure_startup(args.database_url, args.startup_runs),
+        }
+        write_report(report, args.output)
+        return
+    if not args.skip_seed and args.users < 2:
+        sys.exit("--users must be at least 2 so messages have distinct senders and recipients")
+
+    # Database reads its settings from the environment
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('DB_POOL_MAX', str(max(args.concurrency, 1)))
+    from database import Database
+
+    db = Database()
+    try:
+        if not args.skip_seed:
+            started = time.perf_counter()
+            seed(db, args.users, args.messages, args.thread_depth, args.days, args.approved_ratio)
+            logger.info(f"Seeding took {time.perf_counter() - started:.1f}s")
+
+        with db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version() AS version")
+                server_version = cur.fetchone()['version']
+                cur.execute("SELECT COUNT(*) AS users FROM users")
+                user_count = cur.fetchone()['users']
+                cur.execute("SELECT COALESCE(MAX(message_id), 0) AS messages FROM messages")
+                message_count = cur.fetchone()['messages']
+
+        available = scenarios(db, user_count, message_count, args.page_size, args.write_batch)
+        selected = args.only or list(available)
+        unknown = [name for name in selected if name not in available]
+        if unknown:
+            sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+        results = {}
+        for name in selected:
+            results[name] = {}
+            for label, concurrency in (('single', 1), ('concurrent', args.concurrency)):
+                logger.info(f"Running {name} ({label})")
+                results[name][label] = measure(available[name], args.iterations, concurrency, args.warmup)
+
+        report = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'postgres': server_version,
+            'dataset': {
+                'users': user_count,
+                'messages': message_count,
+                'thread_depth': args.thread_depth,
+                'days': args.days,
+                'seeded': not args.skip_seed,
+            },
+            'settings': {
+                'iterations': args.iterations,
+                'warmup': args.warmup,
+                'concurrency': args.concurrency,
+                'write_batch': args.write_batch,
+                'pool_max': int(os.environ['DB_POOL_MAX']),
+            },
+            'results': results,
+        }
+    finally:
+        db.close()
+
+    write_report(report, args.output)
+
+
+def write_report(report, path=None):
+    output = json.dumps(report, indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Report written to {path}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 import os
+import hmac
+import json
 import logging
+import secrets
+import signal
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.request import BaseRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -8,10 +13,25 @@ from telegram.ext import (
     CallbackQueryHandler,
     ConversationHandler,
     ContextTypes,
+    TypeHandler,
     filters,
 )
 import asyncio
-from database import Database
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from broadcast import Broadcaster
+from callbacks import CallbackRouter, PayloadStore, callback_data
+from coordination import LEADER_CHECK_INTERVAL, LeaderElection
+from database import Database, AsyncDatabase, MessageBatcher, USERS_CHANGED_CHANNEL
+from delivery import DeliveryQueue, OutboxWorker
+from maintenance import MaintenanceWorker
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS_LISTEN, METRICS_PORT, REGISTRY, STARTUP_SECONDS,
+    process_uptime, timed_handler,
+)
+from persistence import PostgresPersistence
+from update_processor import PerUserUpdateProcessor
+from webserver import HTTPServer, Request, Response
 
 # Logging
 logging.basicConfig(
@@ -26,11 +46,118 @@ WAITING_NAME, WAITING_SURNAME, WAITING_MESSAGE, WAITING_REPLY, EDIT_NAME, EDIT_S
 # Admin ID
 ADMIN_ID = 1125355606
 
+# Recipients shown per page in the /send picker
+RECIPIENTS_PAGE_SIZE = 10
+
+# Users shown per page in /users and /deleteuser
+ADMIN_USERS_PAGE_SIZE = 20
+
+# Messages shown per page in /inbox and /sent, and characters shown of each
+MAILBOX_PAGE_SIZE = 5
+MAILBOX_PREVIEW_LENGTH = 500
+
+# Messages shown per page of a conversation, and characters shown of each
+THREAD_PAGE_SIZE = 8
+THREAD_PREVIEW_LENGTH = 400
+
+# Optional status filters for /users and /deleteuser
+USER_STATUS_FILTERS = ('pending', 'approved')
+
+# Statements listed by /queries by default and at most
+QUERY_STATS_DEFAULT = 10
+QUERY_STATS_MAX = 20
+# Statement text shown per entry in /queries
+QUERY_STATS_TEXT_LENGTH = 150
+
+# Telegram's limit for one text message
+MAX_MESSAGE_LENGTH = 4096
+
+# How updates are received: 'polling' (default) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+
+# Webhook settings (BOT_MODE=webhook)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Run as one of several instances sharing the webhook, database and state (needs BOT_MODE=webhook)
+MULTI_INSTANCE = os.getenv('MULTI_INSTANCE', '').lower() in ('1', 'true', 'yes')
+
+# Serve /healthz and /readyz on this port (in webhook mode they are always on the webhook server)
+HEALTH_PORT = os.getenv('HEALTH_PORT')
+HEALTH_LISTEN = os.getenv('HEALTH_LISTEN', '0.0.0.0')
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def message_cursor(message: Dict) -> Tuple[int, int]:
+    """Keyset cursor of a message for callback_data: (created_at in microseconds, message_id)"""
+    return (message['created_at'] - EPOCH) // timedelta(microseconds=1), message['message_id']
+
+
+def parse_message_cursor(micros: str, message_id: str) -> Tuple[datetime, int]:
+    return EPOCH + timedelta(microseconds=int(micros)), int(message_id)
+
+
+def reply_data(message: Dict) -> str:
+    """callback_data of a reply button; created_at lets the press read a single message partition"""
+    micros, message_id = message_cursor(message)
+    return callback_data('reply', message_id, micros)
+
+
+def preview(text: str, length: int = MAILBOX_PREVIEW_LENGTH) -> str:
+    return text if len(text) <= length else text[:length - 1] + '…'
+
+
 class TainaPoshtaBot:
-    def __init__(self, token: str):
+    def __init__(self, token: str, request: Optional[BaseRequest] = None):
         self.token = token
-        self.db = Database()
-        self.application = Application.builder().token(token).build()
+        self.db = AsyncDatabase(Database())
+        self.messages = MessageBatcher(self.db)
+        self.callbacks = CallbackRouter(PayloadStore(self.db))
+        self.persistence = PostgresPersistence(self.db, shared=MULTI_INSTANCE)
+        builder = (
+            Application.builder()
+            .token(token)
+            .persistence(self.persistence)
+            .concurrent_updates(PerUserUpdateProcessor())
+        )
+        if request:
+            # Bot API calls go through `request` instead of HTTP (the startup benchmark answers them in-process)
+            builder = builder.request(request)
+        self.application = builder.build()
+        self.delivery = DeliveryQueue(self.application.bot)
+        self.outbox = OutboxWorker(
+            self.db, self.delivery,
+            render=self.render_anonymous_message,
+            on_failed=self.notify_sender_delivery_failed,
+        )
+        self.broadcaster = Broadcaster(
+            self.db, self.delivery,
+            render=self.render_broadcast,
+            on_finished=self.notify_admin_broadcast_finished,
+        )
+        self.maintenance = MaintenanceWorker(self.db)
+        # With several instances only the elected leader runs maintenance and broadcasts
+        self.election = None
+        self._leader_task = None
+        if MULTI_INSTANCE:
+            self.broadcaster.active = False
+            self.election = LeaderElection(
+                self.db.database_url,
+                on_elected=self.on_elected,
+                on_demoted=self.on_demoted,
+                channels=[USERS_CHANGED_CHANNEL],
+                on_notify=lambda channel, user_id: self.db.user_cache.invalidate(int(user_id)),
+                on_reconnect=self.db.user_cache.clear,
+            )
+        # HTTP servers by port; the webhook, probes and metrics share one when ports match
+        self.servers: Dict[int, HTTPServer] = {}
+        self.ready = False
+        self.webhook_secret = None
         self._setup_handlers()
 
     def _setup_handlers(self):
@@ -38,41 +165,119 @@ class TainaPoshtaBot:
         
         # Registration conversation
         registration_handler = ConversationHandler(
-            entry_points=[CommandHandler('start', self.start_command)],
+            entry_points=[CommandHandler('start', timed_handler(self.start_command))],
             states={
-                WAITING_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_name)],
-                WAITING_SURNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_surname)],
+                WAITING_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(self.process_name))],
+                WAITING_SURNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(self.process_surname))],
             },
-            fallbacks=[CommandHandler('cancel', self.cancel_command)],
+            fallbacks=[CommandHandler('cancel', timed_handler(self.cancel_command))],
+            name='registration',
+            persistent=True,
         )
         
         # Edit name conversation
         edit_name_handler = ConversationHandler(
-            entry_points=[CommandHandler('editname', self.edit_name_command)],
+            entry_points=[CommandHandler('editname', timed_handler(self.edit_name_command))],
             states={
-                EDIT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_edit_name)],
-                EDIT_SURNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_edit_surname)],
+                EDIT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(self.process_edit_name))],
+                EDIT_SURNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(self.process_edit_surname))],
             },
-            fallbacks=[CommandHandler('cancel', self.cancel_command)],
+            fallbacks=[CommandHandler('cancel', timed_handler(self.cancel_command))],
+            name='edit_name',
+            persistent=True,
         )
         
+        self.conversation_handlers = [registration_handler, edit_name_handler]
         self.application.add_handler(registration_handler)
         self.application.add_handler(edit_name_handler)
-        self.application.add_handler(CommandHandler('help', self.help_command))
-        self.application.add_handler(CommandHandler('send', self.send_command))
-        self.application.add_handler(CommandHandler('admin', self.admin_command))
-        self.application.add_handler(CommandHandler('users', self.admin_users_command))
-        self.application.add_handler(CommandHandler('deleteuser', self.admin_delete_user_command))
-        self.application.add_handler(CommandHandler('myinfo', self.myinfo_command))
-        self.application.add_handler(CallbackQueryHandler(self.button_callback))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        self.application.add_handler(CommandHandler('help', timed_handler(self.help_command)))
+        self.application.add_handler(CommandHandler('send', timed_handler(self.send_command)))
+        self.application.add_handler(CommandHandler('admin', timed_handler(self.admin_command)))
+        self.application.add_handler(CommandHandler('broadcast', timed_handler(self.broadcast_command)))
+        self.application.add_handler(CommandHandler('queries', timed_handler(self.queries_command)))
+        self.application.add_handler(CommandHandler('users', timed_handler(self.admin_users_command)))
+        self.application.add_handler(CommandHandler('deleteuser', timed_handler(self.admin_delete_user_command)))
+        self.application.add_handler(CommandHandler('myinfo', timed_handler(self.myinfo_command)))
+        self.application.add_handler(CommandHandler('inbox', timed_handler(self.inbox_command)))
+        self.application.add_handler(CommandHandler('sent', timed_handler(self.sent_command)))
+        self.register_callbacks()
+        self.application.add_handler(
+            CallbackQueryHandler(timed_handler(self.callbacks.dispatch, classify=self.callbacks.action))
+        )
+        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(self.handle_message)))
+        
+        if MULTI_INSTANCE:
+            # Before and after every other handler group
+            self.application.add_handler(TypeHandler(Update, self.load_shared_state), group=-1)
+            self.application.add_handler(TypeHandler(Update, self.save_shared_state), group=1)
+
+    async def load_shared_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Load the user's conversation states, which another instance may have moved on.
+
+        user_data is reloaded by the persistence before this runs.
+        """
+        if not update.effective_user or not update.effective_chat:
+            return
+        # ConversationHandler's default per_chat + per_user key
+        key = (update.effective_chat.id, update.effective_user.id)
+        await self.persistence.refresh_conversations(self.conversation_handlers, key)
+
+    async def save_shared_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Write this update's user_data and conversation changes now, before the next update can reach another instance"""
+        if update.effective_user:
+            self.application.mark_data_for_update_persistence(user_ids=update.effective_user.id)
+        await self.application.update_persistence()
+        await self.persistence.flush()
+
+    async def on_elected(self):
+        self._leader_task = asyncio.create_task(self._lead())
+
+    async def on_demoted(self):
+        if self._leader_task:
+            self._leader_task.cancel()
+            await asyncio.gather(self._leader_task, return_exceptions=True)
+            self._leader_task = None
+
+    async def _lead(self):
+        """Singleton jobs, run by the leader until it steps down"""
+        await self.maintenance.start()
+        self.broadcaster.active = True
+        try:
+            while True:
+                # Picks up broadcasts started on other instances
+                try:
+                    await self.broadcaster.resume()
+                except Exception as e:
+                    logger.error(f"Error resuming broadcasts: {e}")
+                await asyncio.sleep(LEADER_CHECK_INTERVAL)
+        finally:
+            self.broadcaster.active = False
+            await self.broadcaster.stop()
+            await self.maintenance.stop()
+
+    def register_callbacks(self):
+        """Map inline button actions to their handlers"""
+        route = self.callbacks.route
+        route('approve_name', self.approve_name_callback, stored=True, legacy=lambda args: {
+            'user_id': int(args[0]), 'first_name': args[1], 'last_name': args[2],
+        })
+        route('reject_name', self.reject_name_callback)
+        route('approve', self.approve_callback)
+        route('reject', self.reject_callback)
+        route('userspage', self.users_page_callback)
+        route('delete', self.delete_callback, answers=True)
+        route('sendpage', self.send_page_callback)
+        route('select', self.select_callback)
+        route('reply', self.reply_callback, answers=True)
+        route('boxpage', self.mailbox_page_callback)
+        route('thread', self.thread_callback)
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         user_id = update.effective_user.id
         
         # Check if user already exists
-        user = self.db.get_user(user_id)
+        user = await self.db.get_user(user_id)
         
         if user:
             if user['approved']:
@@ -122,7 +327,7 @@ class TainaPoshtaBot:
         name = context.user_data['name']
         
         # Save to database
-        self.db.add_user(user_id, name, surname, username)
+        await self.db.add_user(user_id, name, surname, username)
         
         await update.message.reply_text(
             f"✅ Дякую, {name} {surname}!\n\n"
@@ -138,7 +343,7 @@ class TainaPoshtaBot:
     async def edit_name_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /editname command"""
         user_id = update.effective_user.id
-        user = self.db.get_user(user_id)
+        user = await self.db.get_user(user_id)
         
         if not user:
             await update.message.reply_text(
@@ -182,7 +387,7 @@ class TainaPoshtaBot:
         name = context.user_data['edit_name']
         
         # Get current user info
-        user = self.db.get_user(user_id)
+        user = await self.db.get_user(user_id)
         old_name = f"{user['first_name']} {user['last_name']}"
         new_name = f"{name} {surname}"
         
@@ -204,7 +409,7 @@ class TainaPoshtaBot:
     async def myinfo_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show user their current information"""
         user_id = update.effective_user.id
-        user = self.db.get_user(user_id)
+        user = await self.db.get_user(user_id)
         
         if not user:
             await update.message.reply_text(
@@ -228,8 +433,8 @@ class TainaPoshtaBot:
         """Notify admin about new registration"""
         keyboard = [
             [
-                InlineKeyboardButton("✅ Підтвердити", callback_data=f"approve_{user_id}"),
-                InlineKeyboardButton("❌ Відхилити", callback_data=f"reject_{user_id}")
+                InlineKeyboardButton("✅ Підтвердити", callback_data=callback_data('approve', user_id)),
+                InlineKeyboardButton("❌ Відхилити", callback_data=callback_data('reject', user_id))
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -244,7 +449,7 @@ class TainaPoshtaBot:
         # Language code
         lang = user_obj.language_code if user_obj.language_code else "не вказано"
         
-        await self.application.bot.send_message(
+        self.delivery.enqueue(
             chat_id=ADMIN_ID,
             text=f"🔔 Нова реєстрація!\n\n"
                  f"📝 Вказане ім'я: {name} {surname}\n"
@@ -258,17 +463,21 @@ class TainaPoshtaBot:
 
     async def notify_admin_name_change(self, user_id: int, old_name: str, new_name: str, new_first: str, new_last: str, username: str):
         """Notify admin about name change request"""
+        # Names may be long or contain any character, so they are stored server-side
+        approve_data = await self.callbacks.make_button_data(
+            'approve_name', {'user_id': user_id, 'first_name': new_first, 'last_name': new_last}
+        )
         keyboard = [
             [
-                InlineKeyboardButton("✅ Підтвердити", callback_data=f"approve_name_{user_id}_{new_first}_{new_last}"),
-                InlineKeyboardButton("❌ Відхилити", callback_data=f"reject_name_{user_id}")
+                InlineKeyboardButton("✅ Підтвердити", callback_data=approve_data),
+                InlineKeyboardButton("❌ Відхилити", callback_data=callback_data('reject_name', user_id))
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         username_text = f"@{username}" if username else "немає username"
         
-        await self.application.bot.send_message(
+        self.delivery.enqueue(
             chat_id=ADMIN_ID,
             text=f"🔄 Запит на зміну імені!\n\n"
                  f"👤 Користувач: {old_name}\n"
@@ -282,7 +491,7 @@ class TainaPoshtaBot:
     async def send_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /send command - show list of users"""
         user_id = update.effective_user.id
-        user = self.db.get_user(user_id)
+        user = await self.db.get_user(user_id)
         
         if not user or not user['approved']:
             await update.message.reply_text(
@@ -291,210 +500,428 @@ class TainaPoshtaBot:
             )
             return
         
-        # Get all approved users except sender
-        users = self.db.get_approved_users(exclude_user_id=user_id)
+        picker = await self._recipient_picker(user_id)
         
-        if not users:
+        if not picker:
             await update.message.reply_text(
                 "😔 Поки що немає інших підтверджених користувачів.\n"
                 "Зачекай, поки хтось ще приєднається!"
             )
             return
         
+        text, reply_markup = picker
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+    async def _recipient_picker(self, user_id: int, after_user_id: int = None, before_user_id: int = None):
+        """Build one page of the recipient picker, or None if there is nobody to write to"""
+        page = await self.db.get_approved_users_page(
+            exclude_user_id=user_id,
+            after_user_id=after_user_id,
+            before_user_id=before_user_id,
+            limit=RECIPIENTS_PAGE_SIZE,
+        )
+        users = page['users']
+        
+        if not users:
+            return None
+        
         # Create inline keyboard with users
         keyboard = []
         for user in users:
             button_text = f"{user['first_name']} {user['last_name']}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"select_{user['user_id']}")])
+            keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data('select', user['user_id']))])
+        
+        # Navigation between pages
+        navigation = []
+        if page['has_prev']:
+            navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=callback_data('sendpage', 'prev', users[0]['user_id'])))
+        if page['has_next']:
+            navigation.append(InlineKeyboardButton("Далі ➡️", callback_data=callback_data('sendpage', 'next', users[-1]['user_id'])))
+        if navigation:
+            keyboard.append(navigation)
+        
+        text = (
+            "💌 Кому хочеш надіслати анонімне повідомлення?\n"
+            "Вибери отримувача зі списку:"
+        )
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def inbox_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /inbox command - received messages, newest first"""
+        await self._send_mailbox_page(update, 'inbox')
+
+    async def sent_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /sent command - sent messages, newest first"""
+        await self._send_mailbox_page(update, 'sent')
+
+    async def _send_mailbox_page(self, update: Update, box: str):
+        user = await self.db.get_user(update.effective_user.id)
+        if not user or not user['approved']:
+            await update.message.reply_text(
+                "❌ Ти ще не підтверджений адміністратором.\n"
+                "Зачекай на підтвердження або напиши /start для реєстрації."
+            )
+            return
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        text, reply_markup = await self._mailbox_view(update.effective_user.id, box)
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+    async def _mailbox_view(self, user_id: int, box: str, older_than: tuple = None, newer_than: tuple = None):
+        """Build one page of /inbox or /sent"""
+        page = await self.db.get_messages_page(
+            user_id, box, older_than=older_than, newer_than=newer_than, limit=MAILBOX_PAGE_SIZE,
+        )
+        messages = page['messages']
+        
+        if not messages:
+            if box == 'inbox':
+                return "📭 Тобі ще ніхто не писав.", None
+            return "📭 Ти ще не надсилав(ла) повідомлень. Використовуй /send", None
+        
+        message_text = "📥 Отримані повідомлення:\n\n" if box == 'inbox' else "📤 Надіслані повідомлення:\n\n"
+        reply_buttons = []
+        thread_buttons = []
+        for number, message in enumerate(messages, 1):
+            if message['thread_id']:
+                thread_buttons.append(InlineKeyboardButton(
+                    f"🧵 {number}", callback_data=callback_data('thread', message['root_id'])
+                ))
+            sent_at = message['created_at'].strftime('%d.%m.%Y %H:%M')
+            if box == 'inbox':
+                kind = "💬 Відповідь" if message['thread_id'] else "💌 Повідомлення"
+                message_text += f"{number}. {kind} · {sent_at}\n{preview(message['message_text'])}\n\n"
+                reply_buttons.append(InlineKeyboardButton(
+                    f"💬 {number}", callback_data=reply_data(message)
+                ))
+            else:
+                # The other side of a reply may be the anonymous author - never name them
+                if message['thread_id']:
+                    recipient = "відповідь у розмові"
+                else:
+                    recipient = f"{message['recipient_first_name'] or ''} {message['recipient_last_name'] or ''}".strip()
+                message_text += f"{number}. {sent_at} → {recipient}\n{preview(message['message_text'])}\n\n"
+        
+        if reply_buttons:
+            message_text += "💡 Натисни номер, щоб відповісти анонімно.\n"
+        if thread_buttons:
+            message_text += "🧵 — уся розмова, до якої належить відповідь."
+        
+        keyboard = [buttons for buttons in (reply_buttons, thread_buttons) if buttons]
+        # Navigation between pages
+        navigation = []
+        if page['has_prev']:
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Новіші", callback_data=callback_data('boxpage', box, 'prev', *message_cursor(messages[0]))
+            ))
+        if page['has_next']:
+            navigation.append(InlineKeyboardButton(
+                "Старіші ➡️", callback_data=callback_data('boxpage', box, 'next', *message_cursor(messages[-1]))
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        
+        return message_text.rstrip(), InlineKeyboardMarkup(keyboard) if keyboard else None
+
+    async def mailbox_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """/inbox and /sent pages; args are box, direction and the cursor message's (micros, message_id)"""
+        query = update.callback_query
+        box, direction, micros, message_id = args
+        cursor = parse_message_cursor(micros, message_id)
+        if direction == 'next':
+            text, reply_markup = await self._mailbox_view(query.from_user.id, box, older_than=cursor)
+        else:
+            text, reply_markup = await self._mailbox_view(query.from_user.id, box, newer_than=cursor)
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
+    async def thread_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """A whole conversation; args are the root message_id, then direction and cursor when paging"""
+        query = update.callback_query
+        root_id = int(args[0])
+        if len(args) == 1:
+            # Opened from a message or a mailbox page - keep that in place
+            text, reply_markup = await self._thread_view(query.from_user.id, root_id)
+            await query.message.reply_text(text, reply_markup=reply_markup)
+            return
         
-        await update.message.reply_text(
-            "💌 Кому хочеш надіслати анонімне повідомлення?\n"
-            "Вибери отримувача зі списку:",
-            reply_markup=reply_markup
+        direction, micros, message_id = args[1:]
+        cursor = parse_message_cursor(micros, message_id)
+        if direction == 'next':
+            text, reply_markup = await self._thread_view(query.from_user.id, root_id, after=cursor)
+        else:
+            text, reply_markup = await self._thread_view(query.from_user.id, root_id, before=cursor)
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
+    async def _thread_view(self, user_id: int, root_id: int, after: tuple = None, before: tuple = None):
+        """Build one page of a conversation, oldest first, as seen by `user_id`"""
+        page = await self.db.get_thread_page(root_id, user_id, after=after, before=before, limit=THREAD_PAGE_SIZE)
+        messages = page['messages']
+        
+        # Only participants get rows back, so this also covers someone else's conversation
+        if not messages:
+            return "❌ Розмову не знайдено.", None
+        
+        # Both sides stay anonymous: the other participant is never named
+        message_text = "🧵 Розмова:\n\n"
+        for message in messages:
+            author = "Ти" if message['sender_id'] == user_id else "Співрозмовник"
+            sent_at = message['created_at'].strftime('%d.%m.%Y %H:%M')
+            message_text += f"{author} · {sent_at}\n{preview(message['message_text'], THREAD_PREVIEW_LENGTH)}\n\n"
+        
+        keyboard = []
+        if not page['has_next']:
+            # The latest message from the other side can be answered right here
+            received = [message for message in messages if message['recipient_id'] == user_id]
+            if received:
+                keyboard.append([InlineKeyboardButton(
+                    "💬 Відповісти", callback_data=reply_data(received[-1])
+                )])
+        
+        # Navigation between pages
+        navigation = []
+        if page['has_prev']:
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Раніші", callback_data=callback_data('thread', root_id, 'prev', *message_cursor(messages[0]))
+            ))
+        if page['has_next']:
+            navigation.append(InlineKeyboardButton(
+                "Пізніші ➡️", callback_data=callback_data('thread', root_id, 'next', *message_cursor(messages[-1]))
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        
+        return message_text.rstrip(), InlineKeyboardMarkup(keyboard) if keyboard else None
+
+    async def approve_name_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, payload: Dict):
+        """Admin approves a name change; payload holds user_id, first_name and last_name"""
+        query = update.callback_query
+        if query.from_user.id != ADMIN_ID:
+            await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
+            return
+        
+        user_id = payload['user_id']
+        new_first = payload['first_name']
+        new_last = payload['last_name']
+        
+        # Update name in database; a second press (or another instance) finds it already done
+        if not await self.db.update_user_name(user_id, new_first, new_last):
+            await query.edit_message_text("ℹ️ Цю зміну імені вже оброблено.")
+            return
+        
+        await query.edit_message_text(
+            f"✅ Зміну імені підтверджено!\n\n"
+            f"Нове ім'я: {new_first} {new_last}"
+        )
+        
+        # Notify user
+        self.delivery.enqueue(
+            chat_id=user_id,
+            text=f"✅ Твій запит на зміну імені підтверджено!\n\n"
+                 f"Твоє нове ім'я: {new_first} {new_last}\n\n"
+                 f"Тепер інші користувачі бачитимуть тебе під цим ім'ям."
         )
 
-    async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle button clicks"""
+    async def reject_name_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """Admin rejects a name change"""
         query = update.callback_query
-        await query.answer()
+        if query.from_user.id != ADMIN_ID:
+            await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
+            return
         
-        data = query.data
+        user_id = int(args[0])
+        user = await self.db.get_user(user_id)
         
-        # Name change approval
-        if data.startswith('approve_name_'):
-            if query.from_user.id != ADMIN_ID:
-                await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
-                return
-            
-            parts = data.split('_')
-            user_id = int(parts[2])
-            new_first = parts[3]
-            new_last = parts[4]
-            
-            # Update name in database
-            self.db.update_user_name(user_id, new_first, new_last)
-            
-            await query.edit_message_text(
-                f"✅ Зміну імені підтверджено!\n\n"
-                f"Нове ім'я: {new_first} {new_last}"
-            )
-            
-            # Notify user
-            try:
-                await self.application.bot.send_message(
-                    chat_id=user_id,
-                    text=f"✅ Твій запит на зміну імені підтверджено!\n\n"
-                         f"Твоє нове ім'я: {new_first} {new_last}\n\n"
-                         f"Тепер інші користувачі бачитимуть тебе під цим ім'ям."
-                )
-            except Exception as e:
-                logger.error(f"Could not notify user about name change: {e}")
+        await query.edit_message_text(
+            f"❌ Зміну імені відхилено для користувача {user['first_name']} {user['last_name']}"
+        )
         
-        elif data.startswith('reject_name_'):
-            if query.from_user.id != ADMIN_ID:
-                await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
-                return
-            
-            user_id = int(data.split('_')[2])
-            user = self.db.get_user(user_id)
-            
-            await query.edit_message_text(
-                f"❌ Зміну імені відхилено для користувача {user['first_name']} {user['last_name']}"
-            )
-            
-            # Notify user
-            try:
-                await self.application.bot.send_message(
-                    chat_id=user_id,
-                    text="❌ На жаль, твій запит на зміну імені відхилено.\n"
-                         "Якщо є питання, зв'яжись з адміністратором."
+        # Notify user
+        self.delivery.enqueue(
+            chat_id=user_id,
+            text="❌ На жаль, твій запит на зміну імені відхилено.\n"
+                 "Якщо є питання, зв'яжись з адміністратором."
+        )
+
+    async def approve_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """Admin approves a registration"""
+        query = update.callback_query
+        if query.from_user.id != ADMIN_ID:
+            await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
+            return
+        
+        user_id = int(args[0])
+        user = await self.db.approve_user(user_id)
+        if not user:
+            # Already handled by an earlier press, possibly on another instance
+            user = await self.db.get_user(user_id)
+            if user and user['approved']:
+                await query.edit_message_text(
+                    f"ℹ️ Користувач {user['first_name']} {user['last_name']} вже підтверджений."
                 )
-            except Exception as e:
-                logger.error(f"Could not notify user about name change rejection: {e}")
+            else:
+                await query.edit_message_text("❌ Користувача не знайдено — можливо, його вже відхилено.")
+            return
         
-        # Admin approval/rejection
-        elif data.startswith('approve_'):
-            if query.from_user.id != ADMIN_ID:
-                await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
-                return
-            
-            user_id = int(data.split('_')[1])
-            self.db.approve_user(user_id)
-            user = self.db.get_user(user_id)
-            
-            await query.edit_message_text(
-                f"✅ Користувач {user['first_name']} {user['last_name']} підтверджений!"
-            )
-            
-            # Notify user
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text="🎉 Твою реєстрацію підтверджено!\n\n"
-                     "Тепер ти можеш користуватися ботом.\n"
-                     "Використовуй /send щоб надіслати анонімне повідомлення."
-            )
+        await query.edit_message_text(
+            f"✅ Користувач {user['first_name']} {user['last_name']} підтверджений!"
+        )
         
-        elif data.startswith('reject_'):
-            if query.from_user.id != ADMIN_ID:
-                await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
-                return
-            
-            user_id = int(data.split('_')[1])
-            user = self.db.get_user(user_id)
-            self.db.delete_user(user_id)
-            
-            await query.edit_message_text(
-                f"❌ Користувач {user['first_name']} {user['last_name']} відхилений."
-            )
-            
-            # Notify user
-            try:
-                await self.application.bot.send_message(
-                    chat_id=user_id,
-                    text="😔 На жаль, твою реєстрацію не підтверджено.\n"
-                         "Якщо є питання, зв'яжись з адміністратором групи."
-                )
-            except Exception as e:
-                logger.error(f"Could not notify rejected user: {e}")
+        # Notify user
+        self.delivery.enqueue(
+            chat_id=user_id,
+            text="🎉 Твою реєстрацію підтверджено!\n\n"
+                 "Тепер ти можеш користуватися ботом.\n"
+                 "Використовуй /send щоб надіслати анонімне повідомлення."
+        )
+
+    async def reject_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """Admin rejects a registration"""
+        query = update.callback_query
+        if query.from_user.id != ADMIN_ID:
+            await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
+            return
         
-        # Admin delete user from list
-        elif data.startswith('delete_'):
-            if query.from_user.id != ADMIN_ID:
-                await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
-                return
-            
-            user_id_to_delete = int(data.split('_')[1])
-            
-            # Don't allow admin to delete themselves
-            if user_id_to_delete == ADMIN_ID:
-                await query.answer("❌ Ти не можеш видалити себе!", show_alert=True)
-                return
-            
-            user = self.db.get_user(user_id_to_delete)
-            
-            if not user:
-                await query.edit_message_text("❌ Користувача не знайдено.")
-                return
-            
-            # Delete user
-            self.db.delete_user(user_id_to_delete)
-            
-            await query.edit_message_text(
-                f"✅ Користувача {user['first_name']} {user['last_name']} (ID: {user_id_to_delete}) видалено!"
-            )
-            
-            # Notify deleted user
-            try:
-                await self.application.bot.send_message(
-                    chat_id=user_id_to_delete,
-                    text="❌ Твій доступ до бота було скасовано адміністратором.\n"
-                         "Якщо є питання, зв'яжись з лідером молодіжної групи."
-                )
-            except Exception as e:
-                logger.error(f"Could not notify deleted user: {e}")
+        user_id = int(args[0])
+        user = await self.db.delete_user(user_id)
+        if not user:
+            await query.edit_message_text("❌ Користувача не знайдено — можливо, його вже відхилено.")
+            return
         
-        # User selection for sending message
-        elif data.startswith('select_'):
-            recipient_id = int(data.split('_')[1])
-            recipient = self.db.get_user(recipient_id)
-            
-            context.user_data['recipient_id'] = recipient_id
-            context.user_data['reply_to_message'] = None  # This is a new message, not a reply
-            
-            await query.edit_message_text(
-                f"💌 Ти обрав: {recipient['first_name']} {recipient['last_name']}\n\n"
-                "Тепер напиши своє повідомлення. Воно буде надіслане анонімно.\n\n"
-                "❗️ Пам'ятай: повідомлення повинно бути корисним!"
-            )
+        await query.edit_message_text(
+            f"❌ Користувач {user['first_name']} {user['last_name']} відхилений."
+        )
         
-        # Reply to anonymous message
-        elif data.startswith('reply_'):
-            message_id = int(data.split('_')[1])
-            
-            # Get the original message to find who sent it
-            message = self.db.get_message(message_id)
-            
-            if not message:
-                await query.edit_message_text("❌ Повідомлення не знайдено.")
-                return
-            
-            # Store the message_id to reply to
-            context.user_data['reply_to_message'] = message_id
-            context.user_data['recipient_id'] = message['sender_id']  # Reply goes back to sender
-            
+        # Notify user
+        self.delivery.enqueue(
+            chat_id=user_id,
+            text="😔 На жаль, твою реєстрацію не підтверджено.\n"
+                 "Якщо є питання, зв'яжись з адміністратором групи."
+        )
+
+    async def users_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """Admin user list pages; args are view, status, direction and cursor user ID"""
+        query = update.callback_query
+        if query.from_user.id != ADMIN_ID:
+            await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
+            return
+        
+        view, status, direction, cursor = args
+        if direction == 'next':
+            page = await self._users_page_view(view, status, after_user_id=int(cursor))
+        else:
+            page = await self._users_page_view(view, status, before_user_id=int(cursor))
+        
+        if not page:
+            await query.edit_message_text("📋 Користувачів ще немає.")
+            return
+        
+        text, reply_markup = page
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
+    async def delete_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """Admin deletes a user from the list"""
+        query = update.callback_query
+        if query.from_user.id != ADMIN_ID:
             await query.answer()
-            await self.application.bot.send_message(
-                chat_id=query.from_user.id,
-                text="✍️ Напиши свою відповідь. Вона буде надіслана анонімно тій людині, "
-                     "яка надіслала тобі повідомлення."
-            )
+            await query.edit_message_text("❌ Тільки адміністратор може це зробити.")
+            return
+        
+        user_id_to_delete = int(args[0])
+        
+        # Don't allow admin to delete themselves; an alert, so the user list stays as it is
+        if user_id_to_delete == ADMIN_ID:
+            await query.answer("❌ Ти не можеш видалити себе!", show_alert=True)
+            return
+        
+        await query.answer()
+        
+        # Delete user; None if they were already deleted
+        user = await self.db.delete_user(user_id_to_delete)
+        
+        if not user:
+            await query.edit_message_text("❌ Користувача не знайдено.")
+            return
+        
+        await query.edit_message_text(
+            f"✅ Користувача {user['first_name']} {user['last_name']} (ID: {user_id_to_delete}) видалено!"
+        )
+        
+        # Notify deleted user
+        self.delivery.enqueue(
+            chat_id=user_id_to_delete,
+            text="❌ Твій доступ до бота було скасовано адміністратором.\n"
+                 "Якщо є питання, зв'яжись з лідером молодіжної групи."
+        )
+
+    async def send_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """Recipient picker pages; args are direction and cursor user ID"""
+        query = update.callback_query
+        user = await self.db.get_user(query.from_user.id)
+        if not user or not user['approved']:
+            await query.edit_message_text("❌ Ти ще не підтверджений адміністратором.")
+            return
+        
+        direction, cursor = args
+        if direction == 'next':
+            picker = await self._recipient_picker(query.from_user.id, after_user_id=int(cursor))
+        else:
+            picker = await self._recipient_picker(query.from_user.id, before_user_id=int(cursor))
+        
+        if not picker:
+            await query.edit_message_text("😔 Поки що немає інших підтверджених користувачів.")
+            return
+        
+        text, reply_markup = picker
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
+    async def select_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """User picked a recipient for a new message"""
+        query = update.callback_query
+        recipient_id = int(args[0])
+        recipient = await self.db.get_user(recipient_id)
+        
+        context.user_data['recipient_id'] = recipient_id
+        context.user_data['reply_to_message'] = None  # This is a new message, not a reply
+        context.user_data.pop('reply_thread', None)
+        
+        await query.edit_message_text(
+            f"💌 Ти обрав: {recipient['first_name']} {recipient['last_name']}\n\n"
+            "Тепер напиши своє повідомлення. Воно буде надіслане анонімно.\n\n"
+            "❗️ Пам'ятай: повідомлення повинно бути корисним!"
+        )
+
+    async def reply_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+        """User wants to answer an anonymous message"""
+        query = update.callback_query
+        message_id = int(args[0])
+        # Buttons sent before reply_data() carry only the message_id
+        created_at = parse_message_cursor(args[1], message_id)[0] if len(args) > 1 else None
+        
+        # Get the original message to find who sent it
+        message = await self.db.get_message(message_id, created_at)
+        
+        # Only the recipient may answer (the button is also shown in /inbox)
+        if not message or message['recipient_id'] != query.from_user.id:
+            # An alert, so an /inbox or conversation page the button sits on stays as it is
+            await query.answer("❌ Повідомлення не знайдено.", show_alert=True)
+            return
+        
+        await query.answer()
+        
+        # Store the message_id to reply to, and its thread so sending needs no second lookup
+        context.user_data['reply_to_message'] = message_id
+        context.user_data['reply_thread'] = message['root_id'] or message_id
+        context.user_data['recipient_id'] = message['sender_id']  # Reply goes back to sender
+        
+        self.delivery.enqueue(
+            chat_id=query.from_user.id,
+            text="✍️ Напиши свою відповідь. Вона буде надіслана анонімно тій людині, "
+                 "яка надіслала тобі повідомлення."
+        )
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle regular text messages (for sending anonymous messages)"""
         user_id = update.effective_user.id
-        user = self.db.get_user(user_id)
+        user = await self.db.get_user(user_id)
         
         if not user or not user['approved']:
             await update.message.reply_text(
@@ -514,42 +941,17 @@ class TainaPoshtaBot:
         message_text = update.message.text
         reply_to_message = context.user_data.get('reply_to_message')
         
-        # Save message to database
+        # Save message to database; the outbox worker delivers it
         try:
             # If this is a reply, link it to the original message
             thread_id = None
             if reply_to_message:
-                # Get the thread starter (original message)
-                thread_id = self.db.get_thread_starter(reply_to_message)
+                # The thread starter (original message), looked up for replies chosen before it was stored
+                thread_id = context.user_data.get('reply_thread') or await self.db.get_thread_starter(reply_to_message)
             
-            message_id = self.db.save_message(user_id, recipient_id, message_text, thread_id)
-            
-            # Prepare the message for recipient
-            if reply_to_message:
-                message_for_recipient = (
-                    f"💬 Відповідь на твоє анонімне повідомлення:\n\n"
-                    f"{message_text}\n\n"
-                    f"───────────────\n"
-                    f"Людина, якій ти писав(ла), відповіла! 🕊️"
-                )
-            else:
-                message_for_recipient = (
-                    f"💌 Тобі надійшло анонімне повідомлення:\n\n"
-                    f"{message_text}\n\n"
-                    f"───────────────\n"
-                    f"Хтось із нашої спільноти думає про тебе! 🕊️"
-                )
-            
-            # Add reply button
-            keyboard = [[InlineKeyboardButton("💬 Відповісти анонімно", callback_data=f"reply_{message_id}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Send anonymous message to recipient
-            await self.application.bot.send_message(
-                chat_id=recipient_id,
-                text=message_for_recipient,
-                reply_markup=reply_markup
-            )
+            # thread_id is the thread's root, so the new message's root needs no lookup
+            await self.messages.save(user_id, recipient_id, message_text, thread_id, root_id=thread_id)
+            self.outbox.wake()
             
             await update.message.reply_text(
                 "✅ Твоє повідомлення надіслано!\n\n"
@@ -559,6 +961,7 @@ class TainaPoshtaBot:
             # Clear recipient from context
             context.user_data.pop('recipient_id', None)
             context.user_data.pop('reply_to_message', None)
+            context.user_data.pop('reply_thread', None)
             
         except Exception as e:
             logger.error(f"Error sending message: {e}")
@@ -566,6 +969,36 @@ class TainaPoshtaBot:
                 "❌ Не вдалося надіслати повідомлення. Спробуй пізніше."
             )
 
+    def render_anonymous_message(self, message):
+        """Text and reply button shown to the recipient of a stored message"""
+        if message['thread_id']:
+            message_for_recipient = (
+                f"💬 Відповідь на твоє анонімне повідомлення:\n\n"
+                f"{message['message_text']}\n\n"
+                f"───────────────\n"
+                f"Людина, якій ти писав(ла), відповіла! 🕊️"
+            )
+        else:
+            message_for_recipient = (
+                f"💌 Тобі надійшло анонімне повідомлення:\n\n"
+                f"{message['message_text']}\n\n"
+                f"───────────────\n"
+                f"Хтось із нашої спільноти думає про тебе! 🕊️"
+            )
+        
+        # Add reply button
+        keyboard = [[InlineKeyboardButton("💬 Відповісти анонімно", callback_data=reply_data(message))]]
+        if message['thread_id']:
+            keyboard.append([InlineKeyboardButton("🧵 Уся розмова", callback_data=callback_data('thread', message['thread_id']))])
+        return message_for_recipient, InlineKeyboardMarkup(keyboard)
+
+    async def notify_sender_delivery_failed(self, message):
+        """Tell the sender that their anonymous message could not be delivered"""
+        self.delivery.enqueue(
+            chat_id=message['sender_id'],
+            text="❌ Не вдалося доставити твоє повідомлення. Спробуй пізніше."
+        )
+
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
         user_id = update.effective_user.id
@@ -577,13 +1010,17 @@ class TainaPoshtaBot:
                 "👤 Команди для користувачів:\n"
                 "🔹 /start - Реєстрація в боті\n"
                 "🔹 /send - Надіслати анонімне повідомлення\n"
+                "🔹 /inbox - Отримані повідомлення\n"
+                "🔹 /sent - Надіслані повідомлення\n"
                 "🔹 /editname - Змінити своє ім'я\n"
                 "🔹 /myinfo - Подивитись свою інформацію\n"
                 "🔹 /help - Показати цю довідку\n\n"
                 "👨‍💼 Команди адміністратора:\n"
                 "🔹 /admin - Статистика боту\n"
-                "🔹 /users - Список всіх користувачів (з можливістю видалення)\n"
-                "🔹 /deleteuser [ID] - Видалити користувача за ID\n\n"
+                "🔹 /broadcast [текст] - Надіслати оголошення всім підтвердженим користувачам\n"
+                "🔹 /users [pending|approved] - Список користувачів (з можливістю видалення)\n"
+                "🔹 /deleteuser [pending|approved] - Видалити користувача зі списку\n"
+                "🔹 /queries [N|reset] - Найповільніші запити до бази за сумарним часом\n\n"
                 "💡 Використовуй бот для підтримки молоді! 🕊️"
             )
         else:
@@ -592,6 +1029,8 @@ class TainaPoshtaBot:
                 "📖 Довідка по боту Таємна Пошта\n\n"
                 "🔹 /start - Реєстрація в боті\n"
                 "🔹 /send - Надіслати анонімне повідомлення\n"
+                "🔹 /inbox - Отримані повідомлення\n"
+                "🔹 /sent - Надіслані повідомлення\n"
                 "🔹 /editname - Змінити своє ім'я\n"
                 "🔹 /myinfo - Подивитись свою інформацію\n"
                 "🔹 /help - Показати цю довідку\n\n"
@@ -615,15 +1054,20 @@ class TainaPoshtaBot:
             await update.message.reply_text("❌ Ця команда доступна тільки адміністратору.")
             return
         
+        stats = await self.db.get_stats()
+        
         # User statistics
-        total_users = self.db.get_total_users()
-        approved_users = self.db.get_approved_count()
+        total_users = stats['total_users']
+        approved_users = stats['approved_users']
         pending_users = total_users - approved_users
         
         # Message statistics
-        total_messages = self.db.get_total_messages()
-        messages_week = self.db.get_messages_last_week()
-        messages_today = self.db.get_messages_today()
+        total_messages = stats['total_messages']
+        messages_week = stats['messages_week']
+        messages_today = stats['messages_today']
+        
+        cache = self.db.user_cache.stats()
+        delivery = self.delivery.stats()
         
         await update.message.reply_text(
             f"📊 Статистика боту:\n\n"
@@ -635,76 +1079,319 @@ class TainaPoshtaBot:
             f"• За сьогодні: {messages_today}\n"
             f"• За тиждень: {messages_week}\n"
             f"• Всього: {total_messages}\n\n"
+            f"🗄 Кеш користувачів:\n"
+            f"• Записів: {cache['size']}\n"
+            f"• Влучань: {cache['hits']} | Промахів: {cache['misses']} | Витіснень: {cache['evictions']}\n\n"
+            f"📤 Черга відправки:\n"
+            f"• В черзі: {delivery['queued']} | Відправляється: {delivery['in_flight']}\n"
+            f"• Надіслано: {delivery['sent']} | Помилок: {delivery['failed']} | Повторів: {delivery['retried']}\n\n"
             f"💡 /users - список користувачів\n"
             f"💡 /deleteuser - видалити користувача"
         )
 
-    async def admin_users_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Admin command to see all users with delete buttons"""
+    async def queries_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin command to see the database statements with the most total time"""
         if update.effective_user.id != ADMIN_ID:
             await update.message.reply_text("❌ Ця команда доступна тільки адміністратору.")
             return
         
-        all_users = self.db.get_all_users()
+        argument = context.args[0].lower() if context.args else ''
+        if argument == 'reset':
+            await self.db.reset_query_stats()
+            await update.message.reply_text("🧹 Статистику запитів очищено.")
+            return
         
-        if not all_users:
-            await update.message.reply_text("📋 Користувачів ще немає.")
+        limit = QUERY_STATS_DEFAULT
+        if argument:
+            if not argument.isdigit() or int(argument) < 1:
+                await update.message.reply_text("❌ Використання: /queries [N|reset]")
+                return
+            limit = min(int(argument), QUERY_STATS_MAX)
+        
+        statements = await self.db.get_query_stats(limit)
+        if not statements:
+            await update.message.reply_text("📭 Запитів ще не було.")
             return
         
-        # Create list with buttons to delete users
-        keyboard = []
-        message_text = "👥 Список всіх користувачів:\n\n"
+        message_text = f"🐢 Топ-{len(statements)} запитів за сумарним часом:\n\n"
+        for i, entry in enumerate(statements, 1):
+            statement = entry['statement']
+            if len(statement) > QUERY_STATS_TEXT_LENGTH:
+                statement = statement[:QUERY_STATS_TEXT_LENGTH] + '…'
+            entry_text = (
+                f"{i}. {', '.join(entry['callers'])}\n"
+                f"⏱ {entry['total_ms']:.0f} мс всього | {entry['calls']} викликів | "
+                f"сер. {entry['mean_ms']:.1f} мс | макс. {entry['max_ms']:.1f} мс | рядків: {entry['rows']}\n"
+                f"{statement}\n\n"
+            )
+            # Split into several messages rather than hit Telegram's length limit
+            if len(message_text) + len(entry_text) > MAX_MESSAGE_LENGTH:
+                await update.message.reply_text(message_text)
+                message_text = ''
+            message_text += entry_text
         
-        for user in all_users:
-            status = "✅" if user['approved'] else "⏳"
-            username_text = f"@{user['username']}" if user['username'] else "немає"
-            message_text += f"{status} {user['first_name']} {user['last_name']}\n   ID: {user['user_id']} | {username_text}\n\n"
-            
-            button_text = f"🗑 {user['first_name']} {user['last_name']}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"delete_{user['user_id']}")])
+        await update.message.reply_text(message_text)
+
+    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin command to send an announcement to all approved users"""
+        if update.effective_user.id != ADMIN_ID:
+            await update.message.reply_text("❌ Ця команда доступна тільки адміністратору.")
+            return
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Everything after the command, keeping line breaks
+        message_text = update.message.text.partition(' ')[2].strip()
+        
+        if not message_text:
+            await update.message.reply_text(
+                "📢 Напиши текст оголошення після команди, наприклад:\n"
+                "/broadcast Зустріч молоді в суботу о 18:00!"
+            )
+            return
+        
+        broadcast_id = await self.broadcaster.start(message_text)
         
         await update.message.reply_text(
-            message_text + "💡 Натисни на користувача щоб видалити:",
-            reply_markup=reply_markup
+            f"📢 Розсилку #{broadcast_id} розпочато!\n"
+            f"Я повідомлю, коли вона завершиться."
+        )
+
+    def render_broadcast(self, message_text: str) -> str:
+        """Text of an announcement as recipients see it"""
+        return f"📢 Оголошення від адміністратора:\n\n{message_text}"
+
+    async def notify_admin_broadcast_finished(self, broadcast, run_stats):
+        """Report a finished broadcast to the admin"""
+        self.delivery.enqueue(
+            chat_id=ADMIN_ID,
+            text=f"📢 Розсилку #{broadcast['broadcast_id']} завершено!\n\n"
+                 f"• Доставлено: {broadcast['sent_count']}\n"
+                 f"• Помилок: {broadcast['failed_count']}\n"
+                 f"• Час: {run_stats['seconds']:.1f} сек ({run_stats['per_second']:.1f} повідомлень/сек)"
         )
 
+    async def admin_users_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin command to see all users with delete buttons"""
+        await self._send_users_page(update, context, 'list')
+
     async def admin_delete_user_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Admin command to delete user - shows list with buttons"""
+        await self._send_users_page(update, context, 'delete')
+
+    async def _send_users_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE, view: str):
+        """Reply with the first page of /users or /deleteuser, optionally filtered by status"""
         if update.effective_user.id != ADMIN_ID:
             await update.message.reply_text("❌ Ця команда доступна тільки адміністратору.")
             return
         
-        all_users = self.db.get_all_users()
+        status = context.args[0].lower() if context.args else 'all'
+        if status != 'all' and status not in USER_STATUS_FILTERS:
+            await update.message.reply_text(
+                "❌ Невідомий фільтр. Використовуй pending або approved, наприклад:\n"
+                f"/{'users' if view == 'list' else 'deleteuser'} pending"
+            )
+            return
+        
+        page = await self._users_page_view(view, status)
         
-        if not all_users:
+        if not page:
             await update.message.reply_text("📋 Користувачів ще немає.")
             return
         
+        text, reply_markup = page
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+    async def _users_page_view(self, view: str, status: str, after_user_id: int = None, before_user_id: int = None):
+        """Build one page of the admin user list ('list' or 'delete' view), or None if it is empty"""
+        page = await self.db.get_users_page(
+            status=None if status == 'all' else status,
+            after_user_id=after_user_id,
+            before_user_id=before_user_id,
+            limit=ADMIN_USERS_PAGE_SIZE,
+        )
+        users = page['users']
+        
+        if not users:
+            return None
+        
         # Create list with buttons to delete users
         keyboard = []
-        message_text = "🗑 Видалення користувачів\n\n"
-        message_text += "Натисни на користувача щоб видалити:\n\n"
+        if view == 'list':
+            message_text = "👥 Список всіх користувачів:\n\n"
+        else:
+            message_text = "🗑 Видалення користувачів\n\n"
+            message_text += "Натисни на користувача щоб видалити:\n\n"
         
-        for user in all_users:
-            status = "✅" if user['approved'] else "⏳"
-            username_text = f"@{user['username']}" if user['username'] else "немає"
+        for user in users:
+            status_icon = "✅" if user['approved'] else "⏳"
             
-            button_text = f"🗑 {user['first_name']} {user['last_name']} ({status})"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"delete_{user['user_id']}")])
+            if view == 'list':
+                username_text = f"@{user['username']}" if user['username'] else "немає"
+                message_text += f"{status_icon} {user['first_name']} {user['last_name']}\n   ID: {user['user_id']} | {username_text}\n\n"
+                button_text = f"🗑 {user['first_name']} {user['last_name']}"
+            else:
+                button_text = f"🗑 {user['first_name']} {user['last_name']} ({status_icon})"
+            keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data('delete', user['user_id']))])
+        
+        # Navigation between pages
+        navigation = []
+        if page['has_prev']:
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Назад", callback_data=callback_data('userspage', view, status, 'prev', users[0]['user_id'])
+            ))
+        if page['has_next']:
+            navigation.append(InlineKeyboardButton(
+                "Далі ➡️", callback_data=callback_data('userspage', view, status, 'next', users[-1]['user_id'])
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        
+        if view == 'list':
+            message_text += "💡 Натисни на користувача щоб видалити:"
+        
+        return message_text, InlineKeyboardMarkup(keyboard)
+
+    async def webhook_handler(self, request: Request) -> Response:
+        """Accept an update posted by Telegram and queue it for processing"""
+        secret = request.headers.get('x-telegram-bot-api-secret-token', '')
+        # compare_digest only takes ASCII str; as bytes any header value is simply a mismatch
+        if not hmac.compare_digest(secret.encode(), self.webhook_secret.encode()):
+            return Response(403)
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
+            payload = json.loads(request.body)
+            if not isinstance(payload, dict):
+                raise ValueError("update is not a JSON object")
+            update = Update.de_json(payload, self.application.bot)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            return Response(400)
+        
+        await self.application.update_queue.put(update)
+        return Response(200)
+
+    async def metrics_handler(self, request: Request) -> Response:
+        """Serve metrics in the Prometheus text format"""
+        return Response(200, REGISTRY.render().encode(), METRICS_CONTENT_TYPE)
+
+    async def healthz_handler(self, request: Request) -> Response:
+        """Liveness: the process is up and its event loop responds"""
+        return Response(200, b'ok')
+
+    async def readyz_handler(self, request: Request) -> Response:
+        """Readiness: updates are being received and processed"""
+        if not self.ready:
+            return Response(503, b'not ready')
+        return Response(200, b'ready')
+
+    async def _http_server(self, host: str, port: int, max_connections: int = None) -> HTTPServer:
+        """The HTTP server on `port`, started on first use"""
+        server = self.servers.get(port)
+        if server is None:
+            server = self.servers[port] = HTTPServer(host, port, max_connections=max_connections)
+            await server.start()
+        return server
+
+    def _add_probes(self, server: HTTPServer):
+        server.route('GET', '/healthz', self.healthz_handler)
+        server.route('GET', '/readyz', self.readyz_handler)
+
+    async def _start_webhook_server(self):
+        """Start accepting webhook requests; updates wait in the queue until the application starts"""
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL environment variable is not set!")
         
-        await update.message.reply_text(
-            message_text,
-            reply_markup=reply_markup
+        # Telegram echoes this token back so we can reject forged requests
+        self.webhook_secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        
+        server = await self._http_server(WEBHOOK_LISTEN, WEBHOOK_PORT, max_connections=WEBHOOK_MAX_CONNECTIONS)
+        server.route('POST', WEBHOOK_PATH, self.webhook_handler)
+        self._add_probes(server)
+
+    async def _set_webhook(self):
+        """Point Telegram at the webhook server"""
+        await self.application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=self.webhook_secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
         )
+        logger.info(f"Webhook set to {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+    def _mark_ready(self):
+        self.ready = True
+        uptime = process_uptime()
+        STARTUP_SECONDS.labels('ready').set(uptime)
+        logger.info(f"Bot is running in {BOT_MODE} mode, ready {uptime:.2f}s after process start")
+
+    async def _serve(self):
+        """Receive and process updates until SIGINT/SIGTERM"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        
+        if MULTI_INSTANCE and BOT_MODE != 'webhook':
+            raise ValueError("MULTI_INSTANCE needs BOT_MODE=webhook: Telegram serves getUpdates to one client only")
+        if MULTI_INSTANCE and not WEBHOOK_SECRET:
+            raise ValueError("MULTI_INSTANCE needs WEBHOOK_SECRET, shared by all instances")
+        
+        # Open the rest of the pool while Telegram and the persisted state are loaded
+        prewarm = asyncio.create_task(self.db.prewarm_pool())
+        # Probes answer (not ready) from the start, so the platform sees the service come up
+        if BOT_MODE == 'webhook':
+            await self._start_webhook_server()
+        if HEALTH_PORT:
+            self._add_probes(await self._http_server(HEALTH_LISTEN, int(HEALTH_PORT)))
+        
+        try:
+            async with self.application:
+                await self.delivery.start()
+                # Safe on every instance: messages are claimed with SKIP LOCKED
+                await self.outbox.start()
+                if self.election:
+                    await self.election.start()
+                else:
+                    await self.maintenance.start()
+                    await self.broadcaster.resume()
+                await self.application.start()
+                if BOT_MODE == 'webhook':
+                    await self._set_webhook()
+                else:
+                    await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                if METRICS_PORT:
+                    server = await self._http_server(METRICS_LISTEN, int(METRICS_PORT))
+                    server.route('GET', '/metrics', self.metrics_handler)
+                
+                self._mark_ready()
+                await stop.wait()
+                
+                logger.info("Stopping Taina Poshta Bot...")
+                self.ready = False
+                for server in self.servers.values():
+                    await server.stop()
+                if self.application.updater.running:
+                    await self.application.updater.stop()
+                await self.application.stop()
+                await self.messages.close()
+                if self.election:
+                    await self.election.stop()
+                else:
+                    await self.broadcaster.stop()
+                    await self.maintenance.stop()
+                await self.outbox.stop()
+                await self.delivery.stop()
+        finally:
+            for server in self.servers.values():
+                await server.stop()
+            await asyncio.gather(prewarm, return_exceptions=True)
 
     def run(self):
         """Run the bot"""
         logger.info("Starting Taina Poshta Bot...")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.db.close()
 
 
 if __name__ == '__main__':
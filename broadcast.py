@@ -0,0 +1,136 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+from database import AsyncDatabase
+from delivery import DeliveryQueue, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# Recipients fetched from the database at a time
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '100'))
+# Broadcast messages allowed in the delivery queue at once
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+
+
+class Broadcaster:
+    """Fans a message out to every approved user in the background.
+
+    Recipients are streamed from the database in batches by user_id and sent
+    through the DeliveryQueue at bulk priority. Each recipient is
+    checkpointed as soon as their send completes (results finishing while a
+    write is in flight go together in the next one), so a broadcast
+    interrupted by a restart resumes where it stopped and resends at most
+    the messages that were in flight.
+
+    With several bot instances only the leader sends (active=True); the
+    others just create the broadcast and the leader's resume() picks it up.
+    """
+
+    def __init__(self, db: AsyncDatabase, queue: DeliveryQueue, render: Callable[[str], str],
+                 on_finished: Optional[Callable[[Dict, Dict], Awaitable[None]]] = None,
+                 batch_size: int = BROADCAST_BATCH_SIZE, concurrency: int = BROADCAST_CONCURRENCY):
+        self.db = db
+        self.queue = queue
+        self.render = render
+        self.on_finished = on_finished
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.active = True
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stopping = False
+
+    async def start(self, message_text: str) -> int:
+        """Create a broadcast and start sending it (if active); returns its ID"""
+        broadcast_id = await self.db.create_broadcast(message_text)
+        if self.active:
+            self._spawn(broadcast_id, message_text)
+        return broadcast_id
+
+    async def resume(self):
+        """Continue broadcasts interrupted by a restart or created by another instance"""
+        if not self.active:
+            return
+        for broadcast in await self.db.get_unfinished_broadcasts():
+            if broadcast['broadcast_id'] not in self._tasks:
+                logger.info(f"Resuming broadcast {broadcast['broadcast_id']}")
+                self._spawn(broadcast['broadcast_id'], broadcast['message_text'])
+
+    async def stop(self, timeout: float = 10):
+        """Stop after the current batch is sent and checkpointed; unfinished broadcasts resume on the next start"""
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = {}
+        self._stopping = False
+
+    def _spawn(self, broadcast_id: int, message_text: str):
+        task = asyncio.create_task(self._run(broadcast_id, message_text))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, broadcast_id: int, message_text: str):
+        text = self.render(message_text)
+        slots = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        sent = failed = 0
+        unrecorded = []
+        recording = asyncio.Lock()
+
+        async def send(user_id: int):
+            nonlocal sent, failed
+            async with slots:
+                try:
+                    await self.queue.enqueue(chat_id=user_id, text=text, priority=PRIORITY_BULK)
+                    unrecorded.append((user_id, 'sent'))
+                except Exception:
+                    unrecorded.append((user_id, 'failed'))
+            # Whoever gets the lock writes every result finished so far; the rest find nothing left
+            async with recording:
+                if not unrecorded:
+                    return
+                results = unrecorded[:]
+                del unrecorded[:]
+                await self.db.record_broadcast_results(broadcast_id, results)
+                batch_sent = sum(1 for _, status in results if status == 'sent')
+                sent += batch_sent
+                failed += len(results) - batch_sent
+
+        try:
+            after_user_id = 0
+            while not self._stopping:
+                user_ids = await self.db.get_broadcast_recipients(broadcast_id, after_user_id, self.batch_size)
+                if not user_ids:
+                    break
+                await asyncio.gather(*(send(user_id) for user_id in user_ids))
+                after_user_id = user_ids[-1]
+            else:
+                logger.info(f"Broadcast {broadcast_id} paused after {sent + failed} recipients")
+                return
+
+            broadcast = await self.db.finish_broadcast(broadcast_id)
+        except asyncio.CancelledError:
+            logger.info(f"Broadcast {broadcast_id} paused after {sent + failed} recipients")
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id} stopped: {e}")
+            return
+
+        elapsed = time.monotonic() - started
+        run_stats = {
+            'sent': sent,
+            'failed': failed,
+            'seconds': elapsed,
+            'per_second': (sent + failed) / elapsed if elapsed > 0 else 0.0,
+        }
+        logger.info(
+            f"Broadcast {broadcast_id} done: {sent} sent, {failed} failed "
+            f"in {elapsed:.1f}s ({run_stats['per_second']:.1f}/s)"
+        )
+        if self.on_finished:
+            await self.on_finished(broadcast, run_stats)
@@ -0,0 +1,156 @@
+import os
+import time
+import secrets
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+from telegram import Update
+from telegram.ext import ContextTypes
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# How long a stored button payload stays valid (seconds); admins may act on a request days later
+CALLBACK_PAYLOAD_TTL = int(os.getenv('CALLBACK_PAYLOAD_TTL', str(30 * 24 * 3600)))
+# Payloads kept in memory; older ones are read back from the database
+CALLBACK_CACHE_SIZE = int(os.getenv('CALLBACK_CACHE_SIZE', '1000'))
+
+# Telegram rejects callback_data longer than this many bytes
+MAX_CALLBACK_DATA = 64
+
+# Buttons sent before the router used '<action>_<arg>_<arg>' data; longest prefix first
+LEGACY_ACTIONS = (
+    'approve_name', 'reject_name', 'approve', 'reject', 'userspage', 'delete', 'sendpage', 'select', 'reply',
+)
+
+
+def callback_data(action: str, *args) -> str:
+    """Pack an action and short arguments (IDs, page cursors) as 'action:arg:arg'"""
+    data = ':'.join([action, *map(str, args)])
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data for {action} is longer than {MAX_CALLBACK_DATA} bytes")
+    return data
+
+
+def parse_callback_data(data: str) -> Tuple[str, List[str], bool]:
+    """Split callback_data into (action, args, legacy)"""
+    action, separator, rest = data.partition(':')
+    if separator:
+        return action, rest.split(':') if rest else [], False
+    for legacy_action in LEGACY_ACTIONS:
+        if data.startswith(legacy_action + '_'):
+            return legacy_action, data[len(legacy_action) + 1:].split('_'), True
+    return data, [], False
+
+
+class PayloadStore:
+    """Button payloads too big for callback_data, behind short random tokens.
+
+    Payloads are written to PostgreSQL, so buttons keep working across
+    restarts, and kept in a bounded in-memory LRU so a press usually needs
+    no query.
+    """
+
+    def __init__(self, db: AsyncDatabase, ttl: int = CALLBACK_PAYLOAD_TTL, max_size: int = CALLBACK_CACHE_SIZE):
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+
+    async def put(self, action: str, payload: Dict) -> str:
+        """Store a payload for `action` and return its token"""
+        token = secrets.token_urlsafe(8)
+        await self.db.save_callback_payload(token, action, payload, self.ttl)
+        self._remember(token, action, payload, self.ttl)
+        return token
+
+    async def get(self, action: str, token: str) -> Optional[Dict]:
+        """The payload stored for `action` under `token`, or None if it is unknown or expired"""
+        entry = self._entries.get(token)
+        if entry is not None:
+            expires, stored_action, payload = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(token)
+                return payload if stored_action == action else None
+            del self._entries[token]
+
+        row = await self.db.load_callback_payload(token, action)
+        if row is None:
+            return None
+        self._remember(token, action, row['payload'], row['expires_in'])
+        return row['payload']
+
+    def _remember(self, token: str, action: str, payload: Dict, ttl: float):
+        self._entries[token] = (time.monotonic() + ttl, action, payload)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE, object], Awaitable[None]]
+
+
+class Route(NamedTuple):
+    handler: Handler
+    # The single argument is a PayloadStore token; the handler receives the payload dict
+    stored: bool = False
+    # Turns a legacy button's args into this route's argument (payload dict for stored routes)
+    legacy: Optional[Callable[[List[str]], object]] = None
+    # The handler answers the query itself (e.g. with an alert); a query can be answered only once
+    answers: bool = False
+
+
+class CallbackRouter:
+    """Dispatches inline button presses to one handler per action.
+
+    callback_data is 'action:arg:...'; the action selects the handler with a
+    dict lookup, and the handler gets the remaining args as a list of
+    strings. Actions registered with stored=True carry a single token and
+    their handler gets the payload saved with make_button_data instead. The
+    query is answered before the handler runs, unless the action is
+    registered with answers=True.
+    """
+
+    def __init__(self, store: PayloadStore):
+        self.store = store
+        self._routes: Dict[str, Route] = {}
+
+    def route(self, action: str, handler: Handler, stored: bool = False,
+              legacy: Optional[Callable[[List[str]], object]] = None, answers: bool = False):
+        if ':' in action:
+            raise ValueError("Callback actions can't contain ':'")
+        self._routes[action] = Route(handler, stored, legacy, answers)
+
+    async def make_button_data(self, action: str, payload: Dict) -> str:
+        """callback_data for a stored action, saving its payload"""
+        return callback_data(action, await self.store.put(action, payload))
+
+    def action(self, update: Update) -> str:
+        """The registered action of a button press, or 'other' (for metrics labels)"""
+        query = update.callback_query
+        action = parse_callback_data(query.data)[0] if query and query.data else ''
+        return action if action in self._routes else 'other'
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        action, args, legacy = parse_callback_data(query.data or '')
+        route = self._routes.get(action)
+        if route is None or not route.answers:
+            await query.answer()
+        if route is None:
+            logger.warning(f"Unknown callback action: {query.data!r}")
+            return
+
+        if legacy:
+            argument = route.legacy(args) if route.legacy else args
+        elif route.stored:
+            argument = await self.store.get(action, args[0]) if len(args) == 1 else None
+            if argument is None:
+                if route.answers:
+                    await query.answer()
+                await query.edit_message_text("⌛ Ця кнопка застаріла. Спробуй ще раз.")
+                return
+        else:
+            argument = args
+
+        await route.handler(update, context, argument)
@@ -0,0 +1,140 @@
+import os
+import time
+import select
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Optional, Sequence
+import psycopg2
+from psycopg2 import sql
+from database import LEADER_LOCK_ID
+from metrics import LEADER
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts to become leader (and checks that the leader's session is alive)
+LEADER_CHECK_INTERVAL = float(os.getenv('LEADER_CHECK_INTERVAL', '5'))
+
+
+class LeaderElection:
+    """Elects one of several bot instances to run singleton jobs.
+
+    Every instance keeps a dedicated PostgreSQL session (outside the pool)
+    and tries pg_try_advisory_lock on it every `interval` seconds. The holder
+    is the leader until its session ends, so a crashed leader is replaced
+    within about one interval. The same session LISTENs on `channels` and
+    passes notifications to `on_notify`.
+
+    The session is driven by its own thread; on_elected/on_demoted run on the
+    event loop, on_notify and on_reconnect on that thread.
+    """
+
+    def __init__(self, dsn: str, on_elected: Callable[[], Awaitable[None]], on_demoted: Callable[[], Awaitable[None]],
+                 channels: Sequence[str] = (), on_notify: Optional[Callable[[str, str], None]] = None,
+                 on_reconnect: Optional[Callable[[], None]] = None,
+                 interval: float = LEADER_CHECK_INTERVAL, lock_id: int = LEADER_LOCK_ID):
+        self.dsn = dsn
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.channels = channels
+        self.on_notify = on_notify
+        self.on_reconnect = on_reconnect
+        self.interval = interval
+        self.lock_id = lock_id
+        self.is_leader = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        # Written to by stop() to wake the thread out of select()
+        self._wake_read, self._wake_write = os.pipe()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._run, name='leader-election', daemon=True)
+        self._thread.start()
+        logger.info("Leader election started")
+
+    async def stop(self):
+        """Stop competing; a leader stops its jobs before closing the session releases the lock"""
+        if not self._thread:
+            return
+        if self.is_leader:
+            await self.on_demoted()
+        self._stopping.set()
+        os.write(self._wake_write, b'x')
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+        self.is_leader = False
+        LEADER.set(0)
+        logger.info("Leader election stopped")
+
+    def _run(self):
+        conn = None
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if conn is None:
+                        conn = self._connect()
+                    self._check(conn)
+                    self._listen(conn, time.monotonic() + self.interval)
+                except psycopg2.Error as e:
+                    logger.error(f"Leader election session failed: {e}")
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+                    # The server drops the lock with the session
+                    if self.is_leader:
+                        self._set_leader(False)
+                    self._stopping.wait(self.interval)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for channel in self.channels:
+                cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+        # Notifications sent while there was no session are lost
+        if self.on_reconnect:
+            self.on_reconnect()
+        return conn
+
+    def _check(self, conn):
+        with conn.cursor() as cur:
+            if self.is_leader:
+                # The lock lives as long as the session
+                cur.execute("SELECT 1")
+                return
+            if self._stopping.is_set():
+                return
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_id,))
+            if cur.fetchone()[0]:
+                self._set_leader(True)
+
+    def _listen(self, conn, deadline: float):
+        """Deliver notifications until `deadline` or stop()"""
+        while not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            readable, _, _ = select.select([conn, self._wake_read], [], [], remaining)
+            if conn in readable:
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    if self.on_notify:
+                        try:
+                            self.on_notify(notify.channel, notify.payload)
+                        except Exception as e:
+                            logger.error(f"Error handling notification on {notify.channel}: {e}")
+
+    def _set_leader(self, leader: bool):
+        self.is_leader = leader
+        LEADER.set(1 if leader else 0)
+        logger.info("This instance is now the leader" if leader else "This instance is no longer the leader")
+        callback = self.on_elected if leader else self.on_demoted
+        asyncio.run_coroutine_threadsafe(callback(), self._loop)
@@ -1,11 +1,765 @@
 import os
+import re
+import sys
+import gzip
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Optional
+from psycopg2 import sql
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from typing import List, Dict, NamedTuple, Optional
 import logging
+from metrics import (
+    DB_CALL_ERRORS, DB_CALL_SECONDS, DB_POOL_CONNECTIONS, DB_POOL_DISCARDED, DB_POOL_TIMEOUTS,
+    DB_POOL_WAIT_SECONDS, MESSAGE_BATCH_ROWS, MESSAGE_PARTITION_END, USER_CACHE,
+)
 
 logger = logging.getLogger(__name__)
 
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Connections idle longer than this are pinged before being handed out
+DB_POOL_CHECK_IDLE = float(os.getenv('DB_POOL_CHECK_IDLE', '30'))
+# Connections opened in the background at startup so the first requests don't pay for them
+DB_POOL_PREWARM = int(os.getenv('DB_POOL_PREWARM', '4'))
+# Threads running queries for the async layer; more than DB_POOL_MAX would only wait for connections
+DB_MAX_WORKERS = int(os.getenv('DB_MAX_WORKERS', str(DB_POOL_MAX)))
+
+# User cache settings
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+
+# Outbox: a claimed message is retried if not confirmed within this many seconds
+OUTBOX_LEASE = int(os.getenv('OUTBOX_LEASE', '120'))
+
+# How long /admin statistics may be served from memory
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '30'))
+
+# Monthly message partitions created ahead of the current month
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv('MESSAGE_PARTITIONS_AHEAD', '3'))
+# Months of messages kept in the database; older partitions are archived and dropped (0 keeps everything)
+MESSAGE_RETENTION_MONTHS = int(os.getenv('MESSAGE_RETENTION_MONTHS', '0'))
+# Directory for archived partitions (gzipped CSV)
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+
+# Messages arriving within this many seconds are written together, up to MESSAGE_BATCH_SIZE rows
+MESSAGE_BATCH_WINDOW = float(os.getenv('MESSAGE_BATCH_WINDOW', '0.005'))
+MESSAGE_BATCH_SIZE = int(os.getenv('MESSAGE_BATCH_SIZE', '100'))
+
+# Statements slower than this (ms) are logged with their plan; 0 turns it off
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+# Explain the same slow statement at most once per this many seconds (EXPLAIN ANALYZE runs it again)
+DB_SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv('DB_SLOW_QUERY_EXPLAIN_INTERVAL', '300'))
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: List[str]
+    # Run outside a transaction, one statement at a time (CREATE INDEX CONCURRENTLY)
+    concurrent: bool = False
+
+
+# Forward-only schema migrations. Never edit an applied step - append a new one.
+MIGRATIONS = [
+    Migration(1, "Create users and messages tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            first_name VARCHAR(255) NOT NULL,
+            last_name VARCHAR(255) NOT NULL,
+            username VARCHAR(255),
+            approved BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id SERIAL PRIMARY KEY,
+            sender_id BIGINT NOT NULL,
+            recipient_id BIGINT NOT NULL,
+            message_text TEXT NOT NULL,
+            thread_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (sender_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            FOREIGN KEY (recipient_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            FOREIGN KEY (thread_id) REFERENCES messages(message_id) ON DELETE SET NULL
+        )
+        """,
+    ]),
+    Migration(2, "Store thread root on messages", [
+        """
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS root_id INTEGER
+        REFERENCES messages(message_id) ON DELETE SET NULL
+        """,
+        # Walk each existing message's thread_id chain up to the message with no parent
+        """
+        WITH RECURSIVE thread_chain AS (
+            SELECT message_id AS start_id, message_id, thread_id
+            FROM messages
+            WHERE root_id IS NULL
+
+            UNION ALL
+
+            SELECT tc.start_id, m.message_id, m.thread_id
+            FROM messages m
+            INNER JOIN thread_chain tc ON m.message_id = tc.thread_id
+        )
+        UPDATE messages m SET root_id = tc.message_id
+        FROM thread_chain tc
+        WHERE tc.thread_id IS NULL AND m.message_id = tc.start_id
+        """,
+    ]),
+    Migration(3, "Index messages for stats and thread lookups", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_created_at_idx ON messages (created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_sender_id_idx ON messages (sender_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_recipient_id_idx ON messages (recipient_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_thread_id_idx ON messages (thread_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_root_id_idx ON messages (root_id)",
+    ], concurrent=True),
+    Migration(4, "Index users for approval filters and roster sorting", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS users_approved_name_idx
+        ON users (first_name, last_name, user_id) WHERE approved
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS users_roster_idx
+        ON users (approved DESC, first_name, last_name, user_id)
+        """,
+    ], concurrent=True),
+    Migration(5, "Index the unfiltered admin roster order", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS users_admin_roster_idx
+        ON users ((NOT approved), first_name, last_name, user_id)
+        """,
+    ], concurrent=True),
+    Migration(6, "Persist user_data and conversation states", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_user_data (
+            user_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bot_conversations (
+            name VARCHAR(64) NOT NULL,
+            conversation_key TEXT NOT NULL,
+            state JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (name, conversation_key)
+        )
+        """,
+    ]),
+    Migration(7, "Track delivery state of messages (outbox)", [
+        # Rows stored before the outbox were delivered synchronously
+        """
+        ALTER TABLE messages
+            ADD COLUMN IF NOT EXISTS delivery_status VARCHAR(16) NOT NULL DEFAULT 'delivered',
+            ADD COLUMN IF NOT EXISTS delivery_attempts INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMP
+        """,
+        """
+        ALTER TABLE messages
+            ALTER COLUMN delivery_status SET DEFAULT 'pending',
+            ALTER COLUMN next_attempt_at SET DEFAULT CURRENT_TIMESTAMP
+        """,
+    ]),
+    Migration(8, "Index pending outbox messages", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_outbox_idx
+        ON messages (next_attempt_at) WHERE delivery_status = 'pending'
+        """,
+    ], concurrent=True),
+    Migration(9, "Broadcasts with per-recipient checkpoints", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id SERIAL PRIMARY KEY,
+            message_text TEXT NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'running',
+            sent_count INTEGER NOT NULL DEFAULT 0,
+            failed_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL REFERENCES broadcasts(broadcast_id) ON DELETE CASCADE,
+            user_id BIGINT NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id)
+        )
+        """,
+    ]),
+    # A partitioned table's primary key must include the partition key, and nothing can reference
+    # message_id alone any more, so thread_id/root_id lose their foreign keys. Deleting a message
+    # (or archiving its partition) leaves replies pointing at a missing parent, which readers
+    # already treat like a message that never existed.
+    Migration(10, "Partition messages by month", [
+        "ALTER TABLE messages RENAME TO messages_unpartitioned",
+        "ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey",
+        "ALTER SEQUENCE messages_message_id_seq OWNED BY NONE",
+        """
+        CREATE TABLE messages (
+            message_id INTEGER NOT NULL DEFAULT nextval('messages_message_id_seq'),
+            sender_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            recipient_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            message_text TEXT NOT NULL,
+            thread_id INTEGER,
+            root_id INTEGER,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            delivery_status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            delivery_attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP,
+            PRIMARY KEY (message_id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """,
+        # One partition per month from the oldest message to MESSAGE_PARTITIONS_AHEAD months ahead; the
+        # maintenance job adds more. There is no DEFAULT partition: it would rule out DETACH CONCURRENTLY
+        f"""
+        DO $$
+        DECLARE
+            month DATE;
+        BEGIN
+            SELECT date_trunc('month', COALESCE(MIN(created_at), CURRENT_TIMESTAMP))::date INTO month
+            FROM messages_unpartitioned;
+            WHILE month <= date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '{MESSAGE_PARTITIONS_AHEAD} months' LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    'messages_' || to_char(month, 'YYYY_MM'), month, (month + INTERVAL '1 month')::date
+                );
+                month := (month + INTERVAL '1 month')::date;
+            END LOOP;
+        END
+        $$
+        """,
+        """
+        INSERT INTO messages (message_id, sender_id, recipient_id, message_text, thread_id, root_id, created_at,
+                              delivery_status, delivery_attempts, next_attempt_at, delivered_at)
+        SELECT message_id, sender_id, recipient_id, message_text, thread_id, root_id,
+               COALESCE(created_at, CURRENT_TIMESTAMP),
+               delivery_status, delivery_attempts, next_attempt_at, delivered_at
+        FROM messages_unpartitioned
+        """,
+        "DROP TABLE messages_unpartitioned",
+        "ALTER SEQUENCE messages_message_id_seq OWNED BY messages.message_id",
+        # Indexes on the parent are created on every partition, present and future
+        "CREATE INDEX messages_created_at_idx ON messages (created_at)",
+        "CREATE INDEX messages_sender_id_idx ON messages (sender_id)",
+        "CREATE INDEX messages_recipient_id_idx ON messages (recipient_id)",
+        "CREATE INDEX messages_thread_id_idx ON messages (thread_id)",
+        "CREATE INDEX messages_root_id_idx ON messages (root_id)",
+        "CREATE INDEX messages_outbox_idx ON messages (next_attempt_at) WHERE delivery_status = 'pending'",
+        "ANALYZE messages",
+    ]),
+    # Per-day counters kept in step with users and messages by statement-level triggers. Each
+    # connection adds to one of 8 slot rows per day, so concurrent writers don't queue on a single
+    # hot row. Users count on the day they registered, messages on the day they were sent. Dropping
+    # an archived partition fires no trigger, so archived messages stay counted.
+    Migration(11, "Maintain daily statistics rollup", [
+        """
+        CREATE TABLE daily_stats (
+            day DATE NOT NULL,
+            slot SMALLINT NOT NULL DEFAULT 0,
+            users INTEGER NOT NULL DEFAULT 0,
+            approved_users INTEGER NOT NULL DEFAULT 0,
+            messages INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, slot)
+        )
+        """,
+        """
+        CREATE FUNCTION daily_stats_messages() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO daily_stats AS s (day, slot, messages)
+                SELECT created_at::date, pg_backend_pid() % 8, COUNT(*) FROM new_rows GROUP BY 1 ORDER BY 1
+                ON CONFLICT (day, slot) DO UPDATE SET messages = s.messages + EXCLUDED.messages;
+            ELSE
+                INSERT INTO daily_stats AS s (day, slot, messages)
+                SELECT created_at::date, pg_backend_pid() % 8, -COUNT(*) FROM old_rows GROUP BY 1 ORDER BY 1
+                ON CONFLICT (day, slot) DO UPDATE SET messages = s.messages + EXCLUDED.messages;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER messages_daily_stats_insert AFTER INSERT ON messages
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION daily_stats_messages()
+        """,
+        """
+        CREATE TRIGGER messages_daily_stats_delete AFTER DELETE ON messages
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION daily_stats_messages()
+        """,
+        """
+        CREATE FUNCTION daily_stats_users() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO daily_stats AS s (day, slot, users, approved_users)
+                SELECT COALESCE(created_at, CURRENT_TIMESTAMP)::date, pg_backend_pid() % 8,
+                       COUNT(*), COUNT(*) FILTER (WHERE approved)
+                FROM new_rows GROUP BY 1 ORDER BY 1
+                ON CONFLICT (day, slot) DO UPDATE
+                SET users = s.users + EXCLUDED.users, approved_users = s.approved_users + EXCLUDED.approved_users;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO daily_stats AS s (day, slot, users, approved_users)
+                SELECT COALESCE(created_at, CURRENT_TIMESTAMP)::date, pg_backend_pid() % 8,
+                       -COUNT(*), -COUNT(*) FILTER (WHERE approved)
+                FROM old_rows GROUP BY 1 ORDER BY 1
+                ON CONFLICT (day, slot) DO UPDATE
+                SET users = s.users + EXCLUDED.users, approved_users = s.approved_users + EXCLUDED.approved_users;
+            ELSE
+                INSERT INTO daily_stats AS s (day, slot, approved_users)
+                SELECT day, pg_backend_pid() % 8, SUM(delta) FROM (
+                    SELECT COALESCE(n.created_at, CURRENT_TIMESTAMP)::date AS day,
+                           n.approved::int - o.approved::int AS delta
+                    FROM new_rows n JOIN old_rows o ON o.user_id = n.user_id
+                    WHERE n.approved IS DISTINCT FROM o.approved
+                ) changes
+                GROUP BY day ORDER BY day
+                ON CONFLICT (day, slot) DO UPDATE SET approved_users = s.approved_users + EXCLUDED.approved_users;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER users_daily_stats_insert AFTER INSERT ON users
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION daily_stats_users()
+        """,
+        """
+        CREATE TRIGGER users_daily_stats_delete AFTER DELETE ON users
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION daily_stats_users()
+        """,
+        """
+        CREATE TRIGGER users_daily_stats_update AFTER UPDATE ON users
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION daily_stats_users()
+        """,
+        """
+        INSERT INTO daily_stats (day, users, approved_users, messages)
+        SELECT day, SUM(users), SUM(approved_users), SUM(messages) FROM (
+            SELECT COALESCE(created_at, CURRENT_TIMESTAMP)::date AS day,
+                   COUNT(*) AS users, COUNT(*) FILTER (WHERE approved) AS approved_users, 0 AS messages
+            FROM users GROUP BY 1
+            UNION ALL
+            SELECT created_at::date, 0, 0, COUNT(*) FROM messages GROUP BY 1
+        ) counts
+        GROUP BY day
+        """,
+    ]),
+    Migration(12, "Store inline button payloads", [
+        """
+        CREATE TABLE IF NOT EXISTS callback_payloads (
+            token VARCHAR(32) PRIMARY KEY,
+            action VARCHAR(32) NOT NULL,
+            payload JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS callback_payloads_expires_at_idx ON callback_payloads (expires_at)",
+    ]),
+    Migration(13, "Announce user changes to other bot instances", [
+        """
+        CREATE FUNCTION notify_users_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('users_changed', OLD.user_id::text);
+            ELSE
+                PERFORM pg_notify('users_changed', NEW.user_id::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER users_changed AFTER INSERT OR UPDATE OR DELETE ON users
+        FOR EACH ROW EXECUTE FUNCTION notify_users_changed()
+        """,
+    ]),
+    Migration(14, "Keyset indexes for inbox and sent history", [
+        "CREATE INDEX IF NOT EXISTS messages_inbox_idx ON messages (recipient_id, created_at, message_id)",
+        "CREATE INDEX IF NOT EXISTS messages_sent_idx ON messages (sender_id, created_at, message_id)",
+        # Lookups by recipient or sender alone (e.g. ON DELETE CASCADE) use the new indexes
+        "DROP INDEX IF EXISTS messages_recipient_id_idx",
+        "DROP INDEX IF EXISTS messages_sender_id_idx",
+    ]),
+    Migration(15, "Keyset index for conversation threads", [
+        "CREATE INDEX IF NOT EXISTS messages_thread_idx ON messages (root_id, created_at, message_id)",
+        # Lookups by root_id alone use the new index
+        "DROP INDEX IF EXISTS messages_root_id_idx",
+    ]),
+    # The full roster it ordered is only ever read a page at a time (users_admin_roster_idx)
+    Migration(16, "Drop the unused users roster index", [
+        "DROP INDEX CONCURRENTLY IF EXISTS users_roster_idx",
+    ], concurrent=True),
+]
+
+# Advisory lock key held while migrating
+SCHEMA_LOCK_ID = 5_120_311
+# Advisory lock key held by the instance running singleton jobs (see coordination.py)
+LEADER_LOCK_ID = 5_120_312
+# Channel notified with the user_id whenever a users row changes (migration 13)
+USERS_CHANGED_CHANNEL = 'users_changed'
+
+# Appended to a "WHERE message_id = %s" lookup with (created_at, created_at) parameters. Without
+# created_at the lookup probes every partition's primary key; with it the planner (parameters are
+# inlined by psycopg2) folds the NULL test away and reads one partition.
+_PARTITION_KEY = " AND (%s::timestamp IS NULL OR created_at = %s)"
+
+# Monthly partitions are named messages_YYYY_MM
+MESSAGE_PARTITION_NAME = re.compile(r'^messages_(\d{4})_(\d{2})$')
+
+
+def missing_partition(error: Exception) -> bool:
+    """True if an insert failed because no messages partition covers the row's created_at"""
+    return (isinstance(error, psycopg2.errors.CheckViolation)
+            and 'no partition of relation' in str(error))
+
+
+def add_months(month: date, months: int) -> date:
+    """First day of the month `months` after (or before) `month`"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_REPEATED_ROWS = re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+_WHITESPACE = re.compile(r"\s+")
+_READ_ONLY = re.compile(r"(SELECT|WITH)\b", re.IGNORECASE)
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|NEXTVAL|SETVAL)\b", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=512)
+def fingerprint(query: str) -> str:
+    """Normalize a statement so executions that differ only in values group together"""
+    query = _STRING_LITERAL.sub('?', query)
+    query = _PLACEHOLDER.sub('?', query)
+    query = _NUMBER_LITERAL.sub('?', query)
+    query = _WHITESPACE.sub(' ', query).strip()
+    # execute_values inlines one (...) group per row
+    return _REPEATED_ROWS.sub(r'\1, ...', query)
+
+
+class QueryProfiler:
+    """Per-statement call counts, timings and row counts, grouped by fingerprint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._explained = {}
+
+    def record(self, statement: str, caller: str, seconds: float, rows: int):
+        with self._lock:
+            entry = self._statements.get(statement)
+            if entry is None:
+                entry = self._statements[statement] = {
+                    'statement': statement,
+                    'callers': set(),
+                    'calls': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows': 0,
+                }
+            ms = seconds * 1000
+            entry['callers'].add(caller)
+            entry['calls'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['rows'] += max(rows, 0)
+
+    def should_explain(self, statement: str) -> bool:
+        """True at most once per DB_SLOW_QUERY_EXPLAIN_INTERVAL for each statement"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(statement)
+            if last is not None and now - last < DB_SLOW_QUERY_EXPLAIN_INTERVAL:
+                return False
+            self._explained[statement] = now
+            return True
+
+    def top(self, limit: int = 10) -> List[Dict]:
+        """The `limit` statements with the most total time"""
+        with self._lock:
+            entries = [dict(entry, callers=sorted(entry['callers'])) for entry in self._statements.values()]
+        entries.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        for entry in entries:
+            entry['mean_ms'] = entry['total_ms'] / entry['calls']
+        return entries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._explained.clear()
+
+
+QUERY_PROFILER = QueryProfiler()
+
+
+class ProfilingCursor(RealDictCursor):
+    """Cursor that records every statement in QUERY_PROFILER and explains slow SELECTs"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            try:
+                self._profile(query, vars, elapsed)
+            except Exception as e:
+                logger.error(f"Error profiling query: {e}")
+
+    def _profile(self, query, vars, elapsed: float):
+        text = query.decode() if isinstance(query, bytes) else str(query)
+        statement = fingerprint(text)
+        caller = self._caller()
+        QUERY_PROFILER.record(statement, caller, elapsed, self.rowcount)
+
+        if not DB_SLOW_QUERY_MS or elapsed * 1000 < DB_SLOW_QUERY_MS:
+            return
+        plan = ''
+        # EXPLAIN ANALYZE executes the statement again - only do it for reads
+        if _READ_ONLY.match(statement) and not _WRITES.search(statement):
+            if QUERY_PROFILER.should_explain(statement):
+                plan = self._explain(query, vars)
+        logger.warning(
+            f"Slow query in {caller}: {elapsed * 1000:.1f}ms, {self.rowcount} rows: {statement}"
+            + (f"\n{plan}" if plan else '')
+        )
+
+    def _explain(self, query, vars) -> str:
+        conn = self.connection
+        if conn.closed or conn.get_transaction_status() not in (
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE, psycopg2.extensions.TRANSACTION_STATUS_INTRANS):
+            return ''
+        # Plain cursor and a savepoint: a failing EXPLAIN must not abort the caller's transaction
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            in_transaction = not conn.autocommit
+            try:
+                if in_transaction:
+                    cur.execute("SAVEPOINT explain_slow_query")
+                cur.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + self.mogrify(query, vars))
+                plan = '\n'.join(row[0] for row in cur.fetchall())
+                if in_transaction:
+                    cur.execute("RELEASE SAVEPOINT explain_slow_query")
+                return plan
+            except psycopg2.Error as e:
+                if in_transaction:
+                    cur.execute("ROLLBACK TO SAVEPOINT explain_slow_query")
+                return f"(EXPLAIN failed: {e})"
+
+    @staticmethod
+    def _caller() -> str:
+        """Name of the public function that issued the statement.
+
+        psycopg2 helpers like execute_values and private helpers like _messages_page are
+        skipped, so statements are filed under the Database method that was called.
+        """
+        # 0: _caller, 1: _profile, 2: execute
+        frame = sys._getframe(3)
+        first = None
+        while frame is not None:
+            if not frame.f_globals.get('__name__', '').startswith('psycopg2'):
+                name = frame.f_code.co_name
+                if not name.startswith('_'):
+                    return name
+                first = first or name
+            frame = frame.f_back
+        return first or 'unknown'
+
+
+class ConnectionPool:
+    """Bounded pool of PostgreSQL connections with health checks on checkout"""
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int, timeout: float, check_idle: float = DB_POOL_CHECK_IDLE):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._pool = ThreadedConnectionPool(minconn, maxconn, dsn, cursor_factory=ProfilingCursor)
+        # minconn is only opened eagerly; ThreadedConnectionPool closes connections returned beyond
+        # its minconn, so raise it to keep every idle connection instead of reconnecting per burst
+        self._pool.minconn = maxconn
+        # ThreadedConnectionPool raises as soon as it is exhausted - make callers wait instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+
+    def getconn(self):
+        """Borrow a healthy connection, waiting up to `timeout` seconds for a free slot"""
+        started = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.timeout)
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        if not acquired:
+            DB_POOL_TIMEOUTS.inc()
+            raise PoolError(f"No free database connection after {self.timeout}s")
+        try:
+            # Every idle connection may have gone stale; after that the pool opens a fresh one
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                logger.warning("Discarding broken database connection")
+                self._discard(conn)
+            raise PoolError("Could not get a healthy database connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, broken: bool = False):
+        """Return a connection to the pool, closing it if it is broken"""
+        try:
+            broken = broken or conn.closed != 0
+            if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if broken:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+                if conn.closed:
+                    # The pool closes connections whose server went away; id() may be reused
+                    self._last_used.pop(id(conn), None)
+        except Exception as e:
+            logger.error(f"Error returning connection to pool: {e}")
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def prewarm(self, connections: int) -> int:
+        """Open connections until `connections` are idle or lent out; returns how many are open.
+
+        Only free slots are used, so callers are never made to wait.
+        """
+        target = min(connections, self.maxconn)
+        borrowed = []
+        try:
+            while self.stats()['open'] < target:
+                if not self._slots.acquire(blocking=False):
+                    break
+                try:
+                    # With no idle connection left the pool opens a new one
+                    borrowed.append(self._pool.getconn())
+                except Exception:
+                    self._slots.release()
+                    raise
+        finally:
+            for conn in borrowed:
+                self.putconn(conn)
+        return self.stats()['open']
+
+    def closeall(self):
+        """Close every connection in the pool"""
+        if not self._pool.closed:
+            self._pool.closeall()
+        self._last_used.clear()
+
+    def stats(self) -> Dict:
+        """Connections lent out, open and idle in the pool, and the limit"""
+        in_use, idle = len(self._pool._used), len(self._pool._pool)
+        return {
+            'in_use': in_use,
+            'idle': idle,
+            'open': in_use + idle,
+            'max': self.maxconn,
+        }
+
+    def _discard(self, conn):
+        DB_POOL_DISCARDED.inc()
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+class UserCache:
+    """Thread-safe LRU cache of user rows with a time-to-live"""
+
+    MISSING = object()
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a slow read can't store a row that changed meanwhile
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int):
+        """Return the cached user (possibly None) or UserCache.MISSING"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return self.MISSING
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: int, user: Optional[Dict], generation: int):
+        """Store a row loaded while the cache was at `generation`"""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        """Drop a user after it was written"""
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Hit, miss and eviction counters"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
 class Database:
     def __init__(self):
         self.database_url = os.getenv('DATABASE_URL')
@@ -16,45 +770,120 @@ class Database:
         if self.database_url.startswith('postgres://'):
             self.database_url = self.database_url.replace('postgres://', 'postgresql://', 1)
         
-        self._create_tables()
+        self.pool = ConnectionPool(self.database_url, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT)
+        self.user_cache = UserCache()
+        self._stats_cache = None
+        self._stats_lock = threading.Lock()
+        DB_POOL_CONNECTIONS.set_function(lambda: {(state,): n for state, n in self.pool.stats().items()})
+        USER_CACHE.set_function(lambda: {
+            (event,): n for event, n in self.user_cache.stats().items() if event != 'size'
+        })
+        self._migrate()
     
+    @contextmanager
     def get_connection(self):
-        """Get database connection"""
-        return psycopg2.connect(self.database_url, cursor_factory=RealDictCursor)
+        """Borrow a connection from the pool; commits on success, rolls back on error"""
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            with conn:
+                yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.pool.putconn(conn, broken=broken)
     
-    def _create_tables(self):
-        """Create necessary tables if they don't exist"""
-        with self.get_connection() as conn:
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.closeall()
+        logger.info("Database connections closed")
+    
+    def schema_version(self) -> int:
+        """Latest applied migration (0 on an empty database); one cheap query on a pooled connection"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT MAX(version) AS version FROM schema_version")
+                    return cur.fetchone()['version'] or 0
+        except psycopg2.errors.UndefinedTable:
+            return 0
+    
+    def prewarm_pool(self, connections: int = DB_POOL_PREWARM) -> int:
+        """Open pooled connections up front; returns how many are open"""
+        try:
+            return self.pool.prewarm(connections)
+        except Exception as e:
+            logger.error(f"Error prewarming connection pool: {e}")
+            return self.pool.stats()['open']
+    
+    def _migrate(self):
+        """Apply pending schema migrations, in order, exactly once"""
+        # Usual restart: the schema is current and no DDL or advisory lock is needed
+        if self.schema_version() >= MIGRATIONS[-1].version:
+            logger.info(f"Database schema is at version {MIGRATIONS[-1].version}")
+            return
+        
+        # Migrations need their own connection: concurrent index builds can't run inside a transaction
+        conn = psycopg2.connect(self.database_url, cursor_factory=RealDictCursor)
+        try:
+            conn.autocommit = True
             with conn.cursor() as cur:
-                # Users table
+                # Several processes may start at once; only one migrates
+                cur.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_ID,))
                 cur.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id BIGINT PRIMARY KEY,
-                        first_name VARCHAR(255) NOT NULL,
-                        last_name VARCHAR(255) NOT NULL,
-                        username VARCHAR(255),
-                        approved BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
-                
-                # Messages table to track conversation threads
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS messages (
-                        message_id SERIAL PRIMARY KEY,
-                        sender_id BIGINT NOT NULL,
-                        recipient_id BIGINT NOT NULL,
-                        message_text TEXT NOT NULL,
-                        thread_id INTEGER,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (sender_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                        FOREIGN KEY (recipient_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                        FOREIGN KEY (thread_id) REFERENCES messages(message_id) ON DELETE SET NULL
-                    )
-                """)
-                
-                conn.commit()
-        logger.info("Database tables created/verified")
+                cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+                current = cur.fetchone()['version']
+            
+            for migration in MIGRATIONS:
+                if migration.version <= current:
+                    continue
+                logger.info(f"Applying migration {migration.version}: {migration.description}")
+                if migration.concurrent:
+                    self._drop_invalid_indexes(conn)
+                    with conn.cursor() as cur:
+                        for statement in migration.statements:
+                            cur.execute(statement)
+                        cur.execute(
+                            "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                            (migration.version, migration.description)
+                        )
+                else:
+                    conn.autocommit = False
+                    with conn:
+                        with conn.cursor() as cur:
+                            for statement in migration.statements:
+                                cur.execute(statement)
+                            cur.execute(
+                                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                                (migration.version, migration.description)
+                            )
+                    conn.autocommit = True
+        finally:
+            # Closing the session also releases the advisory lock
+            conn.close()
+        logger.info(f"Database schema is at version {MIGRATIONS[-1].version}")
+    
+    @staticmethod
+    def _drop_invalid_indexes(conn):
+        """Drop indexes left invalid by an interrupted CREATE INDEX CONCURRENTLY so it can be retried"""
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.relname AS name
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE NOT i.indisvalid AND n.nspname = current_schema()
+            """)
+            for row in cur.fetchall():
+                logger.warning(f"Dropping invalid index {row['name']}")
+                cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{row["name"]}"')
     
     def add_user(self, user_id: int, first_name: str, last_name: str, username: Optional[str] = None):
         """Add a new user to the database"""
@@ -74,9 +903,16 @@ class Database:
         except Exception as e:
             logger.error(f"Error adding user: {e}")
             raise
+        finally:
+            self.user_cache.invalidate(user_id)
     
     def get_user(self, user_id: int) -> Optional[Dict]:
-        """Get user by ID"""
+        """Get user by ID (read-through cached)"""
+        user = self.user_cache.get(user_id)
+        if user is not UserCache.MISSING:
+            return user
+        
+        generation = self.user_cache.generation
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
@@ -84,98 +920,224 @@ class Database:
                         "SELECT * FROM users WHERE user_id = %s",
                         (user_id,)
                     )
-                    return cur.fetchone()
+                    user = cur.fetchone()
         except Exception as e:
             logger.error(f"Error getting user: {e}")
             return None
+        
+        self.user_cache.put(user_id, user, generation)
+        return user
     
-    def approve_user(self, user_id: int):
-        """Approve a user"""
+    def approve_user(self, user_id: int) -> Optional[Dict]:
+        """Approve a user; returns the user only if this call approved them (None if already approved or gone)"""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(
-                        "UPDATE users SET approved = TRUE WHERE user_id = %s",
+                        "UPDATE users SET approved = TRUE WHERE user_id = %s AND NOT approved RETURNING *",
                         (user_id,)
                     )
+                    user = cur.fetchone()
                     conn.commit()
-            logger.info(f"User {user_id} approved")
+            if user:
+                logger.info(f"User {user_id} approved")
+            return user
         except Exception as e:
             logger.error(f"Error approving user: {e}")
             raise
+        finally:
+            self.user_cache.invalidate(user_id)
     
-    def update_user_name(self, user_id: int, first_name: str, last_name: str):
-        """Update user's name"""
+    def update_user_name(self, user_id: int, first_name: str, last_name: str) -> Optional[Dict]:
+        """Update user's name; returns the user only if this call changed it"""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(
-                        "UPDATE users SET first_name = %s, last_name = %s WHERE user_id = %s",
-                        (first_name, last_name, user_id)
+                        """
+                        UPDATE users SET first_name = %s, last_name = %s
+                        WHERE user_id = %s AND (first_name, last_name) IS DISTINCT FROM (%s, %s)
+                        RETURNING *
+                        """,
+                        (first_name, last_name, user_id, first_name, last_name)
                     )
+                    user = cur.fetchone()
                     conn.commit()
-            logger.info(f"User {user_id} name updated to {first_name} {last_name}")
+            if user:
+                logger.info(f"User {user_id} name updated to {first_name} {last_name}")
+            return user
         except Exception as e:
             logger.error(f"Error updating user name: {e}")
             raise
+        finally:
+            self.user_cache.invalidate(user_id)
     
-    def delete_user(self, user_id: int):
-        """Delete a user"""
+    def delete_user(self, user_id: int) -> Optional[Dict]:
+        """Delete a user; returns the deleted user, or None if another request deleted them first"""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(
-                        "DELETE FROM users WHERE user_id = %s",
+                        "DELETE FROM users WHERE user_id = %s RETURNING *",
                         (user_id,)
                     )
+                    user = cur.fetchone()
                     conn.commit()
-            logger.info(f"User {user_id} deleted")
+            if user:
+                logger.info(f"User {user_id} deleted")
+            return user
         except Exception as e:
             logger.error(f"Error deleting user: {e}")
             raise
+        finally:
+            self.user_cache.invalidate(user_id)
     
-    def get_approved_users(self, exclude_user_id: Optional[int] = None) -> List[Dict]:
-        """Get all approved users, optionally excluding one user"""
+    def get_approved_users_page(self, exclude_user_id: Optional[int] = None, after_user_id: Optional[int] = None,
+                                before_user_id: Optional[int] = None, limit: int = 10) -> Dict:
+        """Get one page of approved users ordered by name, starting after/before the given user"""
+        where = "approved = TRUE"
+        params = ()
+        if exclude_user_id:
+            where += " AND user_id != %s"
+            params = (exclude_user_id,)
         try:
-            with self.get_connection() as conn:
-                with conn.cursor() as cur:
-                    if exclude_user_id:
-                        cur.execute(
-                            """
-                            SELECT * FROM users 
-                            WHERE approved = TRUE AND user_id != %s
-                            ORDER BY first_name, last_name
-                            """,
-                            (exclude_user_id,)
-                        )
-                    else:
-                        cur.execute(
-                            """
-                            SELECT * FROM users 
-                            WHERE approved = TRUE
-                            ORDER BY first_name, last_name
-                            """
-                        )
-                    return cur.fetchall()
+            return self._users_page(where, params, "first_name, last_name, user_id",
+                                    after_user_id, before_user_id, limit)
         except Exception as e:
-            logger.error(f"Error getting approved users: {e}")
-            return []
+            logger.error(f"Error getting approved users page: {e}")
+            return {'users': [], 'has_prev': False, 'has_next': False}
     
-    def get_all_users(self) -> List[Dict]:
-        """Get all users (for admin)"""
+    def get_users_page(self, status: Optional[str] = None, after_user_id: Optional[int] = None,
+                       before_user_id: Optional[int] = None, limit: int = 20) -> Dict:
+        """Get one page of users for admin, approved first; status may be 'approved' or 'pending'"""
         try:
-            with self.get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        SELECT * FROM users 
-                        ORDER BY approved DESC, first_name, last_name
-                        """
-                    )
-                    return cur.fetchall()
+            if status == 'approved':
+                return self._users_page("approved = TRUE", (), "first_name, last_name, user_id",
+                                        after_user_id, before_user_id, limit)
+            if status == 'pending':
+                return self._users_page("approved = FALSE", (), "first_name, last_name, user_id",
+                                        after_user_id, before_user_id, limit)
+            return self._users_page("TRUE", (), "NOT approved, first_name, last_name, user_id",
+                                    after_user_id, before_user_id, limit)
         except Exception as e:
-            logger.error(f"Error getting all users: {e}")
-            return []
+            logger.error(f"Error getting users page: {e}")
+            return {'users': [], 'has_prev': False, 'has_next': False}
+    
+    def _users_page(self, where: str, params: tuple, key: str, after_user_id: Optional[int],
+                    before_user_id: Optional[int], limit: int) -> Dict:
+        """Keyset-paginate users ordered by `key`, a column list ending in user_id"""
+        cursor_id = after_user_id if after_user_id is not None else before_user_id
+        backwards = after_user_id is None and before_user_id is not None
+        conditions = [where]
+        args = list(params)
+        if cursor_id is not None:
+            # Compare against the cursor row's own key, so every page is a single index range scan
+            conditions.append(f"({key}) {'<' if backwards else '>'} (SELECT {key} FROM users WHERE user_id = %s)")
+            args.append(cursor_id)
+        direction = 'DESC' if backwards else 'ASC'
+        order = ', '.join(f"{column} {direction}" for column in key.split(', '))
+        args.append(limit + 1)
+        
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT * FROM users WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT %s",
+                    args
+                )
+                users = cur.fetchall()
+        
+        if not users and cursor_id is not None:
+            # The cursor user was deleted meanwhile - start over from the first page
+            return self._users_page(where, params, key, None, None, limit)
+        
+        has_more = len(users) > limit
+        users = users[:limit]
+        if backwards:
+            users.reverse()
+            return {'users': users, 'has_prev': has_more, 'has_next': True}
+        return {'users': users, 'has_prev': cursor_id is not None, 'has_next': has_more}
+    
+    def get_messages_page(self, user_id: int, box: str = 'inbox', older_than: Optional[tuple] = None,
+                          newer_than: Optional[tuple] = None, limit: int = 5) -> Dict:
+        """Get one page of a user's received ('inbox') or sent ('sent') messages, newest first.
+        
+        `older_than`/`newer_than` is the (created_at, message_id) of the last/first message
+        of the current page. Every page is one range scan of the inbox/sent index.
+        """
+        column = 'recipient_id' if box == 'inbox' else 'sender_id'
+        try:
+            page = self._messages_page(f"m.{column} = %s", (user_id,), older_than, newer_than, limit, newest_first=True)
+        except Exception as e:
+            logger.error(f"Error getting messages page: {e}")
+            return {'messages': [], 'has_prev': False, 'has_next': False}
+        if page is None:
+            # Nothing left in that direction (messages archived meanwhile) - start over from the newest
+            return self.get_messages_page(user_id, box, limit=limit)
+        return page
+    
+    def get_thread_page(self, root_id: int, user_id: int, after: Optional[tuple] = None,
+                        before: Optional[tuple] = None, limit: int = 8) -> Dict:
+        """Get one page of a conversation, oldest first, with only the messages `user_id` sent or received.
+        
+        `after`/`before` is the (created_at, message_id) of the last/first message of the
+        current page. Every page is one range scan of the thread index.
+        """
+        try:
+            page = self._messages_page("m.root_id = %s AND %s IN (m.sender_id, m.recipient_id)",
+                                       (root_id, user_id), after, before, limit, newest_first=False)
+        except Exception as e:
+            logger.error(f"Error getting thread page: {e}")
+            return {'messages': [], 'has_prev': False, 'has_next': False}
+        if page is None:
+            return self.get_thread_page(root_id, user_id, limit=limit)
+        return page
+    
+    def _messages_page(self, where: str, params: tuple, after: Optional[tuple], before: Optional[tuple],
+                       limit: int, newest_first: bool) -> Optional[Dict]:
+        """Keyset-paginate messages by (created_at, message_id); None if a cursor page came back empty
+        
+        `after` continues past the last message of the current page, `before` goes back from its first.
+        """
+        cursor = after if after is not None else before
+        backwards = after is None and before is not None
+        # Scanning towards older messages means going down the index
+        descending = newest_first != backwards
+        conditions = [where]
+        args = list(params)
+        if cursor is not None:
+            operator = '<' if descending else '>'
+            # The plain created_at bound lets the planner skip partitions on the far side of the cursor
+            conditions.append(f"m.created_at {operator}= %s AND (m.created_at, m.message_id) {operator} (%s, %s)")
+            args.extend([cursor[0], *cursor])
+        direction = 'DESC' if descending else 'ASC'
+        args.append(limit + 1)
+        
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT m.message_id, m.sender_id, m.recipient_id, m.message_text, m.thread_id,
+                           m.root_id, m.created_at,
+                           u.first_name AS recipient_first_name, u.last_name AS recipient_last_name
+                    FROM messages m
+                    LEFT JOIN users u ON u.user_id = m.recipient_id
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY m.created_at {direction}, m.message_id {direction}
+                    LIMIT %s
+                    """,
+                    args
+                )
+                messages = cur.fetchall()
+        
+        if not messages and cursor is not None:
+            return None
+        
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if backwards:
+            messages.reverse()
+            return {'messages': messages, 'has_prev': has_more, 'has_next': True}
+        return {'messages': messages, 'has_prev': cursor is not None, 'has_next': has_more}
     
     def get_total_users(self) -> int:
         """Get total number of users"""
@@ -201,69 +1163,240 @@ class Database:
             logger.error(f"Error getting approved count: {e}")
             return 0
     
-    def save_message(self, sender_id: int, recipient_id: int, message_text: str, thread_id: Optional[int] = None) -> int:
-        """Save a message and return its ID"""
+    def save_message(self, sender_id: int, recipient_id: int, message_text: str, thread_id: Optional[int] = None,
+                     root_id: Optional[int] = None) -> int:
+        """Save a message and return its ID.
+        
+        A reply's thread root is `root_id` when the caller knows it; otherwise it is read from
+        the parent, which probes every partition (message_id alone is not the partition key).
+        If no partition covers the current month (maintenance has stopped) it is created and the
+        insert retried once.
+        """
+        for attempt in range(2):
+            try:
+                with self.get_connection() as conn:
+                    with conn.cursor() as cur:
+                        # A reply inherits its parent's root; a new message is its own root. A parent that
+                        # was deleted or archived is taken as the root, so the thread stays in one piece.
+                        # With root_id given the planner folds the lookup away
+                        cur.execute(
+                            """
+                            INSERT INTO messages (message_id, sender_id, recipient_id, message_text, thread_id, root_id)
+                            SELECT new.id, %s, %s, %s, %s, COALESCE(
+                                %s::integer,
+                                (SELECT COALESCE(root_id, message_id) FROM messages WHERE message_id = %s),
+                                %s,
+                                new.id
+                            )
+                            FROM (SELECT nextval(pg_get_serial_sequence('messages', 'message_id')) AS id) new
+                            RETURNING message_id
+                            """,
+                            (sender_id, recipient_id, message_text, thread_id, root_id, thread_id, thread_id)
+                        )
+                        result = cur.fetchone()
+                        conn.commit()
+                        message_id = result['message_id']
+                        logger.info(f"Message saved: {message_id} from {sender_id} to {recipient_id}")
+                        return message_id
+            except Exception as e:
+                if attempt == 0 and missing_partition(e):
+                    self._add_missing_partitions(e)
+                    continue
+                logger.error(f"Error saving message: {e}")
+                raise
+    
+    def save_messages(self, messages: List[tuple]) -> List[int]:
+        """Save (sender_id, recipient_id, message_text, thread_id[, root_id]) rows in one transaction.
+        
+        Returns the IDs in order. Roots are found as in save_message, and a missing partition is
+        handled the same way.
+        """
+        if not messages:
+            return []
+        for attempt in range(2):
+            try:
+                with self.get_connection() as conn:
+                    with conn.cursor() as cur:
+                        # Take the IDs up front so each row's ID is known without relying on RETURNING order
+                        cur.execute(
+                            """
+                            SELECT nextval(pg_get_serial_sequence('messages', 'message_id')) AS id
+                            FROM generate_series(1, %s)
+                            """,
+                            (len(messages),)
+                        )
+                        message_ids = [row['id'] for row in cur.fetchall()]
+                        # Same root rule as save_message; the parent is only looked up for rows without a root
+                        execute_values(
+                            cur,
+                            """
+                            INSERT INTO messages (message_id, sender_id, recipient_id, message_text, thread_id, root_id)
+                            SELECT v.id, v.sender_id, v.recipient_id, v.message_text, v.thread_id, COALESCE(
+                                v.root_id,
+                                (SELECT COALESCE(p.root_id, p.message_id) FROM messages p WHERE p.message_id = v.thread_id),
+                                v.thread_id,
+                                v.id
+                            )
+                            FROM (VALUES %s) AS v (id, sender_id, recipient_id, message_text, thread_id, root_id)
+                            """,
+                            [(message_id, *message, *(None,) * (5 - len(message)))
+                             for message_id, message in zip(message_ids, messages)],
+                            template="(%s::integer, %s::bigint, %s::bigint, %s::text, %s::integer, %s::integer)",
+                            page_size=len(messages)
+                        )
+                        conn.commit()
+                logger.info(f"Saved {len(message_ids)} messages in one batch")
+                return message_ids
+            except Exception as e:
+                if attempt == 0 and missing_partition(e):
+                    self._add_missing_partitions(e)
+                    continue
+                logger.error(f"Error saving message batch: {e}")
+                raise
+    
+    def _add_missing_partitions(self, error: Exception):
+        """Create the partition an insert fell outside of, so the caller can retry it once.
+        
+        Only reached when the maintenance job has stopped pre-creating partitions: there is no
+        DEFAULT partition to catch such rows, since it would rule out DETACH CONCURRENTLY.
+        """
+        logger.error(f"No message partition for the current month, is maintenance running? {error}")
+        self.ensure_message_partitions()
+    
+    def claim_pending_messages(self, limit: int, lease_seconds: int = OUTBOX_LEASE) -> List[Dict]:
+        """Claim up to `limit` messages due for delivery.
+        
+        Claimed rows are leased: their next attempt moves `lease_seconds` ahead, so a worker
+        that dies mid-delivery only delays them. SKIP LOCKED lets several workers claim in parallel.
+        Rows carry created_at, which the mark_* methods take to read a single partition.
+        """
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(
                         """
-                        INSERT INTO messages (sender_id, recipient_id, message_text, thread_id)
-                        VALUES (%s, %s, %s, %s)
-                        RETURNING message_id
+                        UPDATE messages
+                        SET delivery_attempts = delivery_attempts + 1,
+                            next_attempt_at = NOW() + make_interval(secs => %s)
+                        WHERE (message_id, created_at) IN (
+                            SELECT message_id, created_at FROM messages
+                            WHERE delivery_status = 'pending' AND next_attempt_at <= NOW()
+                            ORDER BY next_attempt_at
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING message_id, sender_id, recipient_id, message_text, thread_id, created_at,
+                                  delivery_attempts
                         """,
-                        (sender_id, recipient_id, message_text, thread_id)
+                        (lease_seconds, limit)
+                    )
+                    messages = cur.fetchall()
+                    conn.commit()
+                    return sorted(messages, key=lambda m: m['message_id'])
+        except Exception as e:
+            logger.error(f"Error claiming pending messages: {e}")
+            return []
+    
+    def mark_messages_delivered(self, messages: List[tuple]):
+        """Mark (message_id, created_at) messages as delivered"""
+        message_ids = [message_id for message_id, _ in messages]
+        # message_id is unique, so also matching any of the timestamps only prunes partitions
+        created_at = sorted({created for _, created in messages})
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE messages
+                        SET delivery_status = 'delivered', delivered_at = NOW(), next_attempt_at = NULL
+                        WHERE message_id = ANY(%s) AND created_at = ANY(%s::timestamp[])
+                        """,
+                        (message_ids, created_at)
+                    )
+                    conn.commit()
+        except Exception as e:
+            logger.error(f"Error marking messages delivered: {e}")
+            raise
+    
+    def extend_message_leases(self, messages: List[tuple], lease_seconds: int = OUTBOX_LEASE):
+        """Push back the lease of (message_id, created_at) messages still being delivered"""
+        message_ids = [message_id for message_id, _ in messages]
+        created_at = sorted({created for _, created in messages})
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE messages SET next_attempt_at = NOW() + make_interval(secs => %s)
+                        WHERE message_id = ANY(%s) AND created_at = ANY(%s::timestamp[])
+                          AND delivery_status = 'pending'
+                        """,
+                        (lease_seconds, message_ids, created_at)
+                    )
+                    conn.commit()
+        except Exception as e:
+            logger.error(f"Error extending message leases: {e}")
+            raise
+
+    def reschedule_message(self, message_id: int, delay_seconds: float, created_at: Optional[datetime] = None):
+        """Retry a message's delivery after a delay"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE messages SET next_attempt_at = NOW() + make_interval(secs => %s)
+                        WHERE message_id = %s AND delivery_status = 'pending'
+                        """ + _PARTITION_KEY,
+                        (delay_seconds, message_id, created_at, created_at)
+                    )
+                    conn.commit()
+        except Exception as e:
+            logger.error(f"Error rescheduling message: {e}")
+            raise
+    
+    def mark_message_failed(self, message_id: int, created_at: Optional[datetime] = None):
+        """Give up delivering a message"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE messages SET delivery_status = 'failed', next_attempt_at = NULL WHERE message_id = %s"
+                        + _PARTITION_KEY,
+                        (message_id, created_at, created_at)
                     )
-                    result = cur.fetchone()
                     conn.commit()
-                    message_id = result['message_id']
-                    logger.info(f"Message saved: {message_id} from {sender_id} to {recipient_id}")
-                    return message_id
+            logger.info(f"Message {message_id} marked as failed")
         except Exception as e:
-            logger.error(f"Error saving message: {e}")
+            logger.error(f"Error marking message failed: {e}")
             raise
     
-    def get_message(self, message_id: int) -> Optional[Dict]:
-        """Get message by ID"""
+    def get_message(self, message_id: int, created_at: Optional[datetime] = None) -> Optional[Dict]:
+        """Get message by ID; with its created_at only one partition is read"""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(
-                        "SELECT * FROM messages WHERE message_id = %s",
-                        (message_id,)
+                        "SELECT * FROM messages WHERE message_id = %s" + _PARTITION_KEY,
+                        (message_id, created_at, created_at)
                     )
                     return cur.fetchone()
         except Exception as e:
             logger.error(f"Error getting message: {e}")
             return None
     
-    def get_thread_starter(self, message_id: int) -> int:
-        """Get the original message ID that started the thread"""
+    def get_thread_starter(self, message_id: int, created_at: Optional[datetime] = None) -> int:
+        """Get the original message ID that started the thread; a primary-key read of one partition with created_at"""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    # Follow thread_id back to the original message
                     cur.execute(
-                        """
-                        WITH RECURSIVE thread_chain AS (
-                            SELECT message_id, thread_id, sender_id, recipient_id
-                            FROM messages
-                            WHERE message_id = %s
-                            
-                            UNION ALL
-                            
-                            SELECT m.message_id, m.thread_id, m.sender_id, m.recipient_id
-                            FROM messages m
-                            INNER JOIN thread_chain tc ON m.message_id = tc.thread_id
-                        )
-                        SELECT message_id FROM thread_chain
-                        WHERE thread_id IS NULL
-                        LIMIT 1
-                        """,
-                        (message_id,)
+                        "SELECT COALESCE(root_id, message_id) AS root_id FROM messages WHERE message_id = %s"
+                        + _PARTITION_KEY,
+                        (message_id, created_at, created_at)
                     )
                     result = cur.fetchone()
-                    return result['message_id'] if result else message_id
+                    return result['root_id'] if result else message_id
         except Exception as e:
             logger.error(f"Error getting thread starter: {e}")
             return message_id
@@ -273,7 +1406,7 @@ class Database:
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("SELECT COUNT(*) as count FROM messages")
+                    cur.execute("SELECT COALESCE(SUM(messages), 0) AS count FROM daily_stats")
                     result = cur.fetchone()
                     return result['count'] if result else 0
         except Exception as e:
@@ -285,10 +1418,15 @@ class Database:
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
+                    # Whole days from the rollup; only the partial first day is counted from messages
                     cur.execute(
                         """
-                        SELECT COUNT(*) as count FROM messages 
-                        WHERE created_at >= NOW() - INTERVAL '7 days'
+                        SELECT
+                            (SELECT COALESCE(SUM(messages), 0) FROM daily_stats
+                             WHERE day > (NOW() - INTERVAL '7 days')::date)
+                            + (SELECT COUNT(*) FROM messages
+                               WHERE created_at >= NOW() - INTERVAL '7 days'
+                                 AND created_at < (NOW() - INTERVAL '7 days')::date + 1) AS count
                         """
                     )
                     result = cur.fetchone()
@@ -302,14 +1440,597 @@ class Database:
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
+                    cur.execute("SELECT COALESCE(SUM(messages), 0) AS count FROM daily_stats WHERE day = CURRENT_DATE")
+                    result = cur.fetchone()
+                    return result['count'] if result else 0
+        except Exception as e:
+            logger.error(f"Error getting messages from today: {e}")
+            return 0
+
+    
+    def get_stats(self) -> Dict:
+        """Get all /admin statistics in one round trip (cached for STATS_CACHE_TTL seconds)"""
+        with self._stats_lock:
+            if self._stats_cache and self._stats_cache[0] > time.monotonic():
+                return self._stats_cache[1]
+        
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    # One pass over the daily rollup; only the partial first day of the week
+                    # is counted from messages
+                    cur.execute(
+                        """
+                        SELECT
+                            COALESCE(SUM(users), 0) AS total_users,
+                            COALESCE(SUM(approved_users), 0) AS approved_users,
+                            COALESCE(SUM(messages), 0) AS total_messages,
+                            COALESCE(SUM(messages) FILTER (WHERE day > (NOW() - INTERVAL '7 days')::date), 0)
+                            + (SELECT COUNT(*) FROM messages
+                               WHERE created_at >= NOW() - INTERVAL '7 days'
+                                 AND created_at < (NOW() - INTERVAL '7 days')::date + 1) AS messages_week,
+                            COALESCE(SUM(messages) FILTER (WHERE day = CURRENT_DATE), 0) AS messages_today
+                        FROM daily_stats
+                        """
+                    )
+                    stats = dict(cur.fetchone())
+        except Exception as e:
+            logger.error(f"Error getting stats: {e}")
+            return {
+                'total_users': 0,
+                'approved_users': 0,
+                'total_messages': 0,
+                'messages_week': 0,
+                'messages_today': 0,
+            }
+        
+        with self._stats_lock:
+            self._stats_cache = (time.monotonic() + STATS_CACHE_TTL, stats)
+        return stats
+    
+    def reconcile_daily_stats(self) -> int:
+        """Correct daily_stats against users and messages; returns how many days had drifted.
+        
+        Message counts of days older than the oldest partition still in the database are kept,
+        since their rows were archived. Writers are never blocked: the recount and the rollup are
+        read from one snapshot, and the differences are added like any trigger write.
+        """
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    # Rows committed after the snapshot are missing from both sides, and their
+                    # triggers count them - so the difference is exactly the drift
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
                     cur.execute(
                         """
-                        SELECT COUNT(*) as count FROM messages 
-                        WHERE DATE(created_at) = CURRENT_DATE
+                        WITH bounds AS (
+                            SELECT COALESCE(date_trunc('month', MIN(created_at)), date_trunc('month', NOW()))::date
+                                   AS retained_from
+                            FROM messages
+                        ),
+                        counted AS (
+                            SELECT day, SUM(users) AS users, SUM(approved_users) AS approved_users,
+                                   SUM(messages) AS messages
+                            FROM (
+                                SELECT COALESCE(created_at, CURRENT_TIMESTAMP)::date AS day, COUNT(*) AS users,
+                                       COUNT(*) FILTER (WHERE approved) AS approved_users, 0 AS messages
+                                FROM users GROUP BY 1
+                                UNION ALL
+                                SELECT created_at::date, 0, 0, COUNT(*) FROM messages GROUP BY 1
+                            ) counts
+                            GROUP BY day
+                        ),
+                        rolled_up AS (
+                            SELECT day, SUM(users) AS users, SUM(approved_users) AS approved_users,
+                                   SUM(messages) AS messages
+                            FROM daily_stats GROUP BY day
+                        )
+                        SELECT day,
+                               (COALESCE(c.users, 0) - COALESCE(r.users, 0))::int AS users,
+                               (COALESCE(c.approved_users, 0) - COALESCE(r.approved_users, 0))::int AS approved_users,
+                               CASE WHEN day < bounds.retained_from THEN 0
+                                    ELSE COALESCE(c.messages, 0) - COALESCE(r.messages, 0) END::int AS messages
+                        FROM counted c
+                        FULL JOIN rolled_up r USING (day)
+                        CROSS JOIN bounds
+                        ORDER BY day
                         """
                     )
+                    drift = [row for row in cur.fetchall()
+                             if row['users'] or row['approved_users'] or row['messages']]
+                    conn.commit()
+                    
+                    # Ordinary slot upserts, in day order like the triggers
+                    if drift:
+                        execute_values(
+                            cur,
+                            """
+                            INSERT INTO daily_stats AS s (day, slot, users, approved_users, messages) VALUES %s
+                            ON CONFLICT (day, slot) DO UPDATE
+                            SET users = s.users + EXCLUDED.users,
+                                approved_users = s.approved_users + EXCLUDED.approved_users,
+                                messages = s.messages + EXCLUDED.messages
+                            """,
+                            [(row['day'], 0, row['users'], row['approved_users'], row['messages']) for row in drift],
+                            page_size=len(drift)
+                        )
+                    # Fold the per-connection slots of past days back into one row per day
+                    cur.execute(
+                        """
+                        WITH moved AS (
+                            DELETE FROM daily_stats WHERE slot <> 0 AND day < CURRENT_DATE
+                            RETURNING day, users, approved_users, messages
+                        )
+                        INSERT INTO daily_stats AS s (day, slot, users, approved_users, messages)
+                        SELECT day, 0, SUM(users), SUM(approved_users), SUM(messages)
+                        FROM moved GROUP BY day ORDER BY day
+                        ON CONFLICT (day, slot) DO UPDATE
+                        SET users = s.users + EXCLUDED.users,
+                            approved_users = s.approved_users + EXCLUDED.approved_users,
+                            messages = s.messages + EXCLUDED.messages
+                        """
+                    )
+                    conn.commit()
+            if drift:
+                logger.warning(f"Daily stats had drifted on {len(drift)} days; corrected")
+            with self._stats_lock:
+                self._stats_cache = None
+            return len(drift)
+        except Exception as e:
+            logger.error(f"Error reconciling daily stats: {e}")
+            raise
+    
+    def get_query_stats(self, limit: int = 10) -> List[Dict]:
+        """Statements with the most total execution time since start (or the last reset)"""
+        return QUERY_PROFILER.top(limit)
+    
+    def reset_query_stats(self):
+        """Forget collected statement timings"""
+        QUERY_PROFILER.reset()
+    
+    def load_user_data(self, user_id: int) -> Dict:
+        """Get the persisted bot user_data for one user"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT data FROM bot_user_data WHERE user_id = %s", (user_id,))
                     result = cur.fetchone()
-                    return result['count'] if result else 0
+                    return result['data'] if result else {}
         except Exception as e:
-            logger.error(f"Error getting messages from today: {e}")
+            logger.error(f"Error loading user data: {e}")
+            raise
+    
+    def load_conversations(self, name: str) -> Dict[str, object]:
+        """Get all persisted states of one conversation handler, keyed by the serialized key"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT conversation_key, state FROM bot_conversations WHERE name = %s",
+                        (name,)
+                    )
+                    return {row['conversation_key']: row['state'] for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"Error loading conversations: {e}")
+            return {}
+    
+    def load_conversation_states(self, names: List[str], conversation_key: str) -> Dict[str, object]:
+        """Get the persisted state of one conversation key in each of the named handlers"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT name, state FROM bot_conversations WHERE name = ANY(%s) AND conversation_key = %s",
+                        (names, conversation_key)
+                    )
+                    return {row['name']: row['state'] for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"Error loading conversation states: {e}")
+            raise
+    
+    def save_bot_state(self, user_data: Dict[int, Optional[Dict]], conversations: Dict[tuple, object]):
+        """Write a batch of user_data and conversation states in one transaction.
+        
+        A None (or empty user_data) value deletes the stored row.
+        `conversations` is keyed by (handler name, serialized key).
+        """
+        upsert_users = [(uid, Json(data)) for uid, data in user_data.items() if data]
+        delete_users = [uid for uid, data in user_data.items() if not data]
+        upsert_states = [(name, key, Json(state)) for (name, key), state in conversations.items() if state is not None]
+        delete_states = [(name, key) for (name, key), state in conversations.items() if state is None]
+        
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    if upsert_users:
+                        execute_values(
+                            cur,
+                            """
+                            INSERT INTO bot_user_data (user_id, data) VALUES %s
+                            ON CONFLICT (user_id) DO UPDATE
+                            SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+                            """,
+                            upsert_users
+                        )
+                    if delete_users:
+                        cur.execute("DELETE FROM bot_user_data WHERE user_id = ANY(%s)", (delete_users,))
+                    if upsert_states:
+                        execute_values(
+                            cur,
+                            """
+                            INSERT INTO bot_conversations (name, conversation_key, state) VALUES %s
+                            ON CONFLICT (name, conversation_key) DO UPDATE
+                            SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+                            """,
+                            upsert_states
+                        )
+                    if delete_states:
+                        execute_values(
+                            cur,
+                            """
+                            DELETE FROM bot_conversations c USING (VALUES %s) AS d (name, conversation_key)
+                            WHERE c.name = d.name AND c.conversation_key = d.conversation_key
+                            """,
+                            delete_states
+                        )
+                    conn.commit()
+            logger.debug(f"Saved state for {len(user_data)} users and {len(conversations)} conversations")
+        except Exception as e:
+            logger.error(f"Error saving bot state: {e}")
+            raise
+    
+    def create_broadcast(self, message_text: str) -> int:
+        """Create a broadcast and return its ID"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "INSERT INTO broadcasts (message_text) VALUES (%s) RETURNING broadcast_id",
+                        (message_text,)
+                    )
+                    broadcast_id = cur.fetchone()['broadcast_id']
+                    conn.commit()
+            logger.info(f"Broadcast {broadcast_id} created")
+            return broadcast_id
+        except Exception as e:
+            logger.error(f"Error creating broadcast: {e}")
+            raise
+    
+    def get_unfinished_broadcasts(self) -> List[Dict]:
+        """Get broadcasts that were interrupted before reaching every recipient"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY broadcast_id")
+                    return cur.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting unfinished broadcasts: {e}")
+            return []
+    
+    def get_broadcast_recipients(self, broadcast_id: int, after_user_id: int, limit: int) -> List[int]:
+        """Get the next batch of approved users, by user_id, that this broadcast has not reached yet"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT u.user_id FROM users u
+                    WHERE u.approved = TRUE AND u.user_id > %s
+                      AND NOT EXISTS (
+                          SELECT 1 FROM broadcast_deliveries d
+                          WHERE d.broadcast_id = %s AND d.user_id = u.user_id
+                      )
+                    ORDER BY u.user_id
+                    LIMIT %s
+                    """,
+                    (after_user_id, broadcast_id, limit)
+                )
+                return [row['user_id'] for row in cur.fetchall()]
+    
+    def record_broadcast_results(self, broadcast_id: int, results: List[tuple]):
+        """Checkpoint a batch of (user_id, 'sent' | 'failed') results"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    # Only newly recorded recipients count, so a replayed batch is not counted twice
+                    inserted = execute_values(
+                        cur,
+                        """
+                        INSERT INTO broadcast_deliveries (broadcast_id, user_id, status) VALUES %s
+                        ON CONFLICT (broadcast_id, user_id) DO NOTHING
+                        RETURNING status
+                        """,
+                        [(broadcast_id, user_id, status) for user_id, status in results],
+                        fetch=True
+                    )
+                    sent = sum(1 for row in inserted if row['status'] == 'sent')
+                    cur.execute(
+                        """
+                        UPDATE broadcasts SET sent_count = sent_count + %s, failed_count = failed_count + %s
+                        WHERE broadcast_id = %s
+                        """,
+                        (sent, len(inserted) - sent, broadcast_id)
+                    )
+                    conn.commit()
+        except Exception as e:
+            logger.error(f"Error recording broadcast results: {e}")
+            raise
+    
+    def finish_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        """Mark a broadcast as finished and return its final counts"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE broadcasts SET status = 'finished', finished_at = NOW()
+                        WHERE broadcast_id = %s
+                        RETURNING *
+                        """,
+                        (broadcast_id,)
+                    )
+                    broadcast = cur.fetchone()
+                    conn.commit()
+            logger.info(f"Broadcast {broadcast_id} finished")
+            return broadcast
+        except Exception as e:
+            logger.error(f"Error finishing broadcast: {e}")
+            raise
+
+    def save_callback_payload(self, token: str, action: str, payload: Dict, ttl_seconds: int):
+        """Store an inline button payload under `token` for `ttl_seconds`"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        INSERT INTO callback_payloads (token, action, payload, expires_at)
+                        VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+                        """,
+                        (token, action, Json(payload), ttl_seconds)
+                    )
+                    conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving callback payload: {e}")
+            raise
+    
+    def load_callback_payload(self, token: str, action: str) -> Optional[Dict]:
+        """Get an unexpired button payload and its remaining lifetime in seconds (expires_in)"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT payload, EXTRACT(EPOCH FROM expires_at - NOW())::float AS expires_in
+                        FROM callback_payloads
+                        WHERE token = %s AND action = %s AND expires_at > NOW()
+                        """,
+                        (token, action)
+                    )
+                    return cur.fetchone()
+        except Exception as e:
+            logger.error(f"Error loading callback payload: {e}")
+            return None
+    
+    def delete_expired_callback_payloads(self) -> int:
+        """Remove expired button payloads; returns how many were deleted"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM callback_payloads WHERE expires_at <= NOW()")
+                    deleted = cur.rowcount
+                    conn.commit()
+            return deleted
+        except Exception as e:
+            logger.error(f"Error deleting expired callback payloads: {e}")
             return 0
+    
+    def ensure_message_partitions(self, since: Optional[date] = None,
+                                  months_ahead: int = MESSAGE_PARTITIONS_AHEAD) -> List[str]:
+        """Create missing monthly partitions from `since` (default: this month) to `months_ahead` months ahead"""
+        this_month = date.today().replace(day=1)
+        month = (since or this_month).replace(day=1)
+        last = add_months(this_month, months_ahead)
+        created = []
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    while month <= last:
+                        name = f"messages_{month:%Y_%m}"
+                        cur.execute("SELECT to_regclass(%s) AS oid", (name,))
+                        if cur.fetchone()['oid'] is None:
+                            cur.execute(
+                                sql.SQL("CREATE TABLE {} PARTITION OF messages FOR VALUES FROM (%s) TO (%s)").format(
+                                    sql.Identifier(name)
+                                ),
+                                (month, add_months(month, 1))
+                            )
+                            created.append(name)
+                        month = add_months(month, 1)
+                    conn.commit()
+            MESSAGE_PARTITION_END.set(time.mktime(add_months(last, 1).timetuple()))
+            if created:
+                logger.info(f"Created message partitions: {', '.join(created)}")
+            return created
+        except Exception as e:
+            logger.error(f"Error creating message partitions: {e}")
+            raise
+    
+    def archive_message_partitions(self, retention_months: int = MESSAGE_RETENTION_MONTHS,
+                                   archive_dir: str = ARCHIVE_DIR) -> List[str]:
+        """Detach, archive to gzipped CSV and drop monthly partitions older than `retention_months`.
+        
+        Each partition is detached first, so queries stop seeing it at once, and dropped only after
+        its archive file is safely written. Detaching is CONCURRENTLY, so sends and reads keep going
+        meanwhile. A partition left detached (or half-detached) by an interrupted run is picked up
+        again next time.
+        """
+        if retention_months <= 0:
+            return []
+        cutoff = add_months(date.today().replace(day=1), -retention_months)
+        archived = []
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT c.relname AS name, i.inhparent IS NOT NULL AS attached,
+                               COALESCE(i.inhdetachpending, FALSE) AS detach_pending
+                        FROM pg_class c
+                        JOIN pg_namespace n ON n.oid = c.relnamespace
+                        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+                        WHERE n.nspname = current_schema() AND c.relkind = 'r' AND c.relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+                        ORDER BY c.relname
+                        """
+                    )
+                    partitions = cur.fetchall()
+            
+            os.makedirs(archive_dir, exist_ok=True)
+            for partition in partitions:
+                match = MESSAGE_PARTITION_NAME.match(partition['name'])
+                # A partition holds one month: it is expired once that whole month is before the cutoff
+                if not match or add_months(date(int(match[1]), int(match[2]), 1), 1) > cutoff:
+                    continue
+                name = partition['name']
+                table = sql.Identifier(name)
+                path = os.path.join(archive_dir, f"{name}.csv.gz")
+                
+                if partition['attached']:
+                    # A plain DETACH locks messages for everyone until it gets through; CONCURRENTLY
+                    # only waits for running queries, but can't run inside a transaction
+                    conn = psycopg2.connect(self.database_url)
+                    try:
+                        conn.autocommit = True
+                        with conn.cursor() as cur:
+                            # An interrupted concurrent detach has to be finished with FINALIZE
+                            mode = "FINALIZE" if partition['detach_pending'] else "CONCURRENTLY"
+                            cur.execute(sql.SQL("ALTER TABLE messages DETACH PARTITION {} " + mode).format(table))
+                    finally:
+                        conn.close()
+                    logger.info(f"Detached partition {name}")
+                
+                with self.get_connection() as conn:
+                    with conn.cursor() as cur:
+                        with gzip.open(path + '.tmp', 'wb') as f:
+                            cur.copy_expert(
+                                sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)").format(table).as_string(conn),
+                                f
+                            )
+                        with open(path + '.tmp', 'rb') as f:
+                            os.fsync(f.fileno())
+                        os.replace(path + '.tmp', path)
+                        cur.execute(sql.SQL("DROP TABLE {}").format(table))
+                        conn.commit()
+                logger.info(f"Archived partition {name} to {path}")
+                archived.append(path)
+            return archived
+        except Exception as e:
+            logger.error(f"Error archiving message partitions: {e}")
+            raise
+
+class AsyncDatabase:
+    """Async twin of Database: every public method is awaitable and runs on a dedicated thread pool"""
+
+    def __init__(self, db: Database, max_workers: int = DB_MAX_WORKERS):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking callable on the database thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        seconds = DB_CALL_SECONDS.labels(name)
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await self.run(attr, *args, **kwargs)
+            except Exception:
+                DB_CALL_ERRORS.labels(name).inc()
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - started)
+
+        return method
+
+    def close(self):
+        """Wait for running queries, then close the underlying pool"""
+        self._executor.shutdown(wait=True)
+        self.db.close()
+
+
+class MessageBatcher:
+    """Group-commits messages saved at about the same time.
+
+    save() waits up to `window` seconds for other messages (or until `max_size`
+    are waiting), then all of them are inserted in one transaction. During a
+    burst this turns one commit per message into one commit per batch; each
+    caller still gets its own message_id back.
+    """
+
+    def __init__(self, db: AsyncDatabase, window: float = MESSAGE_BATCH_WINDOW, max_size: int = MESSAGE_BATCH_SIZE):
+        self.db = db
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes = set()
+
+    async def save(self, sender_id: int, recipient_id: int, message_text: str, thread_id: Optional[int] = None,
+                   root_id: Optional[int] = None) -> int:
+        """Queue a message for the next batch and return its ID once it is committed"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((sender_id, recipient_id, message_text, thread_id, root_id), future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    async def close(self):
+        """Write whatever is still waiting"""
+        self._flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._write(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, batch: List[tuple]):
+        MESSAGE_BATCH_ROWS.observe(len(batch))
+        try:
+            message_ids = await self.db.save_messages([message for message, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # One bad row (e.g. a user deleted meanwhile) must not fail the others
+                await asyncio.gather(*(self._write_one(message, future) for message, future in batch))
+            elif not batch[0][1].done():
+                batch[0][1].set_exception(e)
+            return
+        for (_, future), message_id in zip(batch, message_ids):
+            if not future.done():
+                future.set_result(message_id)
+
+    async def _write_one(self, message: tuple, future: asyncio.Future):
+        try:
+            result = await self.db.save_message(*message)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,356 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from database import OUTBOX_LEASE, AsyncDatabase
+from metrics import SEND_QUEUE, SEND_RETRIES, SEND_SECONDS, SENDS
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and 1 per second per chat
+SEND_RATE_GLOBAL = float(os.getenv('SEND_RATE_GLOBAL', '25'))
+SEND_RATE_PER_CHAT = float(os.getenv('SEND_RATE_PER_CHAT', '1'))
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', '8'))
+SEND_MAX_ATTEMPTS = int(os.getenv('SEND_MAX_ATTEMPTS', '5'))
+# Seconds allowed for the queue to drain on shutdown
+SEND_DRAIN_TIMEOUT = float(os.getenv('SEND_DRAIN_TIMEOUT', '10'))
+
+# Outbox worker settings
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+
+# Queue priorities: bulk sends (broadcasts) yield to interactive messages
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Idle per-chat buckets are dropped once there are this many
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Token bucket where callers reserve a token and wait until it is theirs"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it"""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self) -> float:
+        """Take a token if one is free and return 0, else return how many seconds until one is (taking none)"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class Delivery:
+    def __init__(self, chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup],
+                 on_failure: Optional[Callable[[Exception], Awaitable[None]]]):
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.on_failure = on_failure
+        self.attempts = 0
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class DeliveryQueue:
+    """Outbound message queue with global and per-chat rate limits and retries.
+
+    Handlers enqueue and return immediately; worker tasks send in the background,
+    retrying on flood control (RetryAfter) and network errors with backoff.
+    A delivery whose chat is over its rate limit, or that waits for a retry, is
+    put back on the queue when it is due, so workers only pick up messages they
+    can send and a burst to one chat doesn't hold up the others.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = SEND_RATE_GLOBAL, per_chat_rate: float = SEND_RATE_PER_CHAT,
+                 workers: int = SEND_WORKERS, max_attempts: int = SEND_MAX_ATTEMPTS):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = 0
+        self._tasks = []
+        self._callbacks = set()
+        # Timers putting rate-limited and retried deliveries back on the queue
+        self._deferred = set()
+        # Set when Telegram tells us to back off globally
+        self._paused_until = 0.0
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        SEND_QUEUE.set_function(lambda: {('queued',): self.stats()['queued'], ('in_flight',): self.in_flight})
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Delivery queue started with {self.workers} workers")
+
+    async def stop(self, timeout: float = SEND_DRAIN_TIMEOUT):
+        """Give queued messages a chance to go out, then cancel the workers"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Delivery queue stopped with {self._queue.qsize()} messages unsent")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for handle in self._deferred:
+            handle.cancel()
+        self._deferred.clear()
+        logger.info("Delivery queue stopped")
+
+    def enqueue(self, chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                on_failure: Optional[Callable[[Exception], Awaitable[None]]] = None,
+                priority: int = PRIORITY_INTERACTIVE) -> asyncio.Future:
+        """Queue a message; the returned future resolves to the sent Message or the final error"""
+        delivery = Delivery(chat_id, text, reply_markup, on_failure)
+        self._sequence += 1
+        # The sequence number keeps FIFO order within a priority
+        self._queue.put_nowait((priority, self._sequence, delivery))
+        return delivery.future
+
+    def stats(self) -> Dict:
+        """Queue depth and delivery counters"""
+        return {
+            'queued': (self._queue.qsize() if self._queue else 0) + len(self._deferred),
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+        }
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            delivery = item[2]
+            wait = self._chat_bucket(delivery.chat_id).take()
+            if wait > 0:
+                # Don't hold a worker while this chat's bucket refills
+                self._defer(item, wait)
+                continue
+            self.in_flight += 1
+            try:
+                retry_in = await self._attempt(delivery)
+            except Exception as e:
+                logger.error(f"Unexpected error delivering to {delivery.chat_id}: {e}")
+                self._fail(delivery, e)
+                retry_in = None
+            finally:
+                self.in_flight -= 1
+            if retry_in is None:
+                self._queue.task_done()
+            else:
+                self._defer(item, retry_in)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.is_idle()}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _defer(self, item: tuple, delay: float):
+        """Put a delivery taken off the queue back on it after `delay` seconds"""
+        handle = None
+
+        def requeue():
+            self._deferred.discard(handle)
+            self._queue.put_nowait(item)
+            # Completes the get() that deferred it; the put above keeps join() waiting
+            self._queue.task_done()
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._deferred.add(handle)
+
+    async def _attempt(self, delivery: Delivery) -> Optional[float]:
+        """Send once; returns None when the delivery is finished, else seconds until it is retried"""
+        delivery.attempts += 1
+        # The global limit applies to every chat alike, so waiting for it here holds up nobody
+        await asyncio.sleep(max(self._global_bucket.reserve(), self._paused_until - time.monotonic()))
+        try:
+            with SEND_SECONDS.time():
+                message = await self.bot.send_message(
+                    chat_id=delivery.chat_id,
+                    text=delivery.text,
+                    reply_markup=delivery.reply_markup,
+                )
+        except RetryAfter as e:
+            delay = float(e.retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            SEND_RETRIES.labels('flood_control').inc()
+            logger.warning(f"Flood control: pausing sends for {delay}s")
+            retry_in = 0.0
+        except BadRequest as e:
+            # A subclass of NetworkError, but retrying won't help
+            logger.error(f"Could not deliver message to {delivery.chat_id}: {e}")
+            self._fail(delivery, e)
+            return None
+        except NetworkError as e:
+            # Includes TimedOut
+            retry_in = min(2 ** delivery.attempts, 60)
+            SEND_RETRIES.labels('network').inc()
+            logger.warning(f"Network error sending to {delivery.chat_id} (attempt {delivery.attempts}): {e}")
+        except TelegramError as e:
+            logger.error(f"Could not deliver message to {delivery.chat_id}: {e}")
+            self._fail(delivery, e)
+            return None
+        else:
+            self.sent += 1
+            SENDS.labels('sent').inc()
+            if not delivery.future.done():
+                delivery.future.set_result(message)
+            return None
+
+        if delivery.attempts >= self.max_attempts:
+            logger.error(f"Giving up on message to {delivery.chat_id} after {delivery.attempts} attempts")
+            self._fail(delivery, TelegramError("Too many delivery attempts"))
+            return None
+        self.retried += 1
+        return retry_in
+
+    def _fail(self, delivery: Delivery, error: Exception):
+        self.failed += 1
+        SENDS.labels('failed').inc()
+        if not delivery.future.done():
+            delivery.future.set_exception(error)
+            # Nobody may await the future; mark the exception as retrieved
+            delivery.future.exception()
+        if delivery.on_failure:
+            task = asyncio.create_task(delivery.on_failure(error))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+
+class OutboxWorker:
+    """Delivers anonymous messages stored as 'pending' in the messages table.
+
+    Rows are claimed in batches (FOR UPDATE SKIP LOCKED), sent through the
+    DeliveryQueue and marked delivered, retried later with backoff, or marked
+    failed as each send settles. Rows still queued (paced, or waiting out a
+    retry_after) have their lease renewed every half lease, so no other
+    worker picks them up meanwhile. A claimed row that is never confirmed is
+    picked up again once its lease expires, so delivery is at-least-once
+    even across crashes.
+    """
+
+    def __init__(self, db: AsyncDatabase, queue: DeliveryQueue,
+                 render: Callable[[Dict], Tuple[str, Optional[InlineKeyboardMarkup]]],
+                 on_failed: Optional[Callable[[Dict], Awaitable[None]]] = None,
+                 batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, lease: int = OUTBOX_LEASE):
+        self.db = db
+        self.queue = queue
+        self.render = render
+        self.on_failed = on_failed
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info("Outbox worker started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Outbox worker stopped")
+
+    def wake(self):
+        """Check for pending messages now instead of at the next poll"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                delivered = await self.deliver_batch()
+            except Exception as e:
+                logger.error(f"Error in outbox worker: {e}")
+                delivered = 0
+            if delivered < self.batch_size:
+                # Caught up: sleep until woken or the next poll
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def deliver_batch(self) -> int:
+        """Claim and deliver one batch; returns how many messages were claimed"""
+        messages = await self.db.claim_pending_messages(self.batch_size, self.lease)
+        if not messages:
+            return 0
+
+        in_flight = {}
+        for message in messages:
+            text, reply_markup = self.render(message)
+            future = self.queue.enqueue(chat_id=message['recipient_id'], text=text, reply_markup=reply_markup)
+            in_flight[future] = message
+
+        renew_at = time.monotonic() + self.lease / 2
+        while in_flight:
+            done, _ = await asyncio.wait(
+                in_flight, timeout=max(renew_at - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+            )
+            await self._settle([(in_flight.pop(future), future) for future in done])
+            if in_flight and time.monotonic() >= renew_at:
+                await self.db.extend_message_leases(
+                    [(message['message_id'], message['created_at']) for message in in_flight.values()], self.lease
+                )
+                renew_at = time.monotonic() + self.lease / 2
+        return len(messages)
+
+    async def _settle(self, results: List[Tuple[Dict, asyncio.Future]]):
+        """Record the outcome of finished sends"""
+        delivered = []
+        for message, future in results:
+            # A send cancelled by a shutdown is retried like any other transient failure
+            error = asyncio.CancelledError() if future.cancelled() else future.exception()
+            if error is None:
+                delivered.append((message['message_id'], message['created_at']))
+            elif isinstance(error, (Forbidden, BadRequest)) or message['delivery_attempts'] >= self.max_attempts:
+                # Blocked bot, deleted chat or out of retries - don't keep trying
+                await self.db.mark_message_failed(message['message_id'], message['created_at'])
+                if self.on_failed:
+                    await self.on_failed(message)
+            else:
+                delay = min(2 ** message['delivery_attempts'] * 5, 3600)
+                await self.db.reschedule_message(message['message_id'], delay, message['created_at'])
+
+        if delivered:
+            await self.db.mark_messages_delivered(delivered)
@@ -0,0 +1,74 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+from database import AsyncDatabase, MESSAGE_RETENTION_MONTHS
+
+logger = logging.getLogger(__name__)
+
+# Seconds between maintenance runs
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '21600'))
+# Seconds between checks of the daily_stats rollup against the base tables (0 turns them off)
+STATS_RECONCILE_INTERVAL = float(os.getenv('STATS_RECONCILE_INTERVAL', '86400'))
+
+
+class MaintenanceWorker:
+    """Periodic database housekeeping.
+
+    Creates monthly message partitions ahead of time and, when
+    MESSAGE_RETENTION_MONTHS is set, archives and drops expired ones.
+    Expired inline button payloads are deleted.
+    Runs once at start and then every `interval` seconds. The daily_stats
+    rollup is checked against a full recount every `reconcile_interval`
+    seconds (not at start: the recount scans every message).
+    """
+
+    def __init__(self, db: AsyncDatabase, interval: float = MAINTENANCE_INTERVAL,
+                 retention_months: int = MESSAGE_RETENTION_MONTHS,
+                 reconcile_interval: float = STATS_RECONCILE_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self.retention_months = retention_months
+        self.reconcile_interval = reconcile_interval
+        self._last_reconcile = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info("Maintenance worker started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Maintenance worker stopped")
+
+    async def _run(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Run every maintenance job; one failing does not stop the others"""
+        try:
+            await self.db.ensure_message_partitions()
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+        if self.retention_months > 0:
+            try:
+                archived = await self.db.archive_message_partitions(self.retention_months)
+                if archived:
+                    logger.info(f"Archived {len(archived)} message partitions")
+            except Exception as e:
+                logger.error(f"Message archival failed: {e}")
+        deleted = await self.db.delete_expired_callback_payloads()
+        if deleted:
+            logger.info(f"Deleted {deleted} expired button payloads")
+        if self.reconcile_interval > 0 and time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+            self._last_reconcile = time.monotonic()
+            try:
+                await self.db.reconcile_daily_stats()
+            except Exception as e:
+                logger.error(f"Daily stats reconciliation failed: {e}")
@@ -0,0 +1,283 @@
+import os
+import time
+import functools
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Serve /metrics on this port (off when unset)
+METRICS_PORT = os.getenv('METRICS_PORT')
+# Interface the metrics server listens on; keep it private unless a scraper needs to reach it
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+
+# Seconds; covers sub-millisecond cache hits up to slow Telegram calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Fallback start time for process_uptime() where /proc is unavailable
+_IMPORTED_AT = time.monotonic()
+
+
+def process_uptime() -> float:
+    """Seconds since this process started, including interpreter startup and imports where /proc allows"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 (starttime) is in clock ticks since boot; the command name may contain spaces
+            started = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            return max(0.0, float(f.read().split()[0]) - started)
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED_AT
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    """A named metric with optional labels; children are created per label combination"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._function: Optional[Callable[[], object]] = None
+
+    def labels(self, *values) -> '_Child':
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return _Child(self, tuple(str(value) for value in values))
+
+    def set_function(self, function: Callable[[], object]):
+        """Read the value(s) at scrape time: a number, or a dict of label tuple -> number"""
+        self._function = function
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        if self._function is not None:
+            value = self._function()
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            return [(self.name, _format_labels(self.labelnames, key), val) for key, val in items]
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), val) for key, val in items]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples())
+        return '\n'.join(lines)
+
+
+class _Child:
+    """One label combination of a metric"""
+
+    __slots__ = ('metric', 'key')
+
+    def __init__(self, metric: Metric, key: Tuple[str, ...]):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount: float = 1):
+        self.metric._inc(self.key, amount)
+
+    def dec(self, amount: float = 1):
+        self.metric._dec(self.key, amount)
+
+    def set(self, value: float):
+        self.metric._set(self.key, value)
+
+    def observe(self, value: float):
+        self.metric._observe(self.key, value)
+
+    def time(self):
+        return self.metric._time(self.key)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1):
+        self._inc((), amount)
+
+    def _inc(self, key: Tuple[str, ...], amount: float = 1):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float):
+        self._set((), value)
+
+    def inc(self, amount: float = 1):
+        self._inc((), amount)
+
+    def dec(self, amount: float = 1):
+        self._inc((), -amount)
+
+    def _set(self, key: Tuple[str, ...], value: float):
+        with self._lock:
+            self._values[key] = value
+
+    def _inc(self, key: Tuple[str, ...], amount: float = 1):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _dec(self, key: Tuple[str, ...], amount: float = 1):
+        self._inc(key, -amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float):
+        self._observe((), value)
+
+    def time(self):
+        return self._time(())
+
+    def _observe(self, key: Tuple[str, ...], value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def _time(self, key: Tuple[str, ...]):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe(key, time.perf_counter() - started)
+
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Bot metrics, shared by the modules that record them
+UPDATES = counter('bot_updates_total', "Updates processed", ['status'])
+UPDATE_SECONDS = histogram('bot_update_seconds', "Time to process one update")
+UPDATES_IN_PROGRESS = gauge('bot_updates_in_progress', "Updates being processed right now")
+HANDLER_SECONDS = histogram('bot_handler_seconds', "Handler latency", ['handler'])
+HANDLER_ERRORS = counter('bot_handler_errors_total', "Handlers that raised", ['handler'])
+CALLBACK_SECONDS = histogram('bot_callback_seconds', "Inline button latency by callback type", ['type'])
+
+DB_CALL_SECONDS = histogram('db_call_seconds', "Database method latency including the wait for a thread", ['method'])
+DB_CALL_ERRORS = counter('db_call_errors_total', "Database methods that raised", ['method'])
+DB_POOL_WAIT_SECONDS = histogram('db_pool_wait_seconds', "Time spent waiting for a pooled connection")
+DB_POOL_CONNECTIONS = gauge('db_pool_connections', "Pooled connections by state", ['state'])
+DB_POOL_TIMEOUTS = counter('db_pool_timeouts_total', "Checkouts that gave up waiting for a connection")
+DB_POOL_DISCARDED = counter('db_pool_discarded_total', "Broken connections closed by the pool")
+MESSAGE_BATCH_ROWS = histogram(
+    'db_message_batch_rows', "Messages written per batch", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+USER_CACHE = counter('user_cache_events_total', "User cache hits, misses and evictions", ['event'])
+
+MESSAGE_PARTITION_END = gauge(
+    'db_message_partition_end_timestamp_seconds', "When the last message partition ends; inserts need a new one past it"
+)
+
+LEADER = gauge('bot_leader', "1 while this instance is the elected leader running singleton jobs")
+STARTUP_SECONDS = gauge('bot_startup_seconds', "Seconds from process start to each startup milestone", ['milestone'])
+
+SEND_SECONDS = histogram('telegram_send_seconds', "Latency of one sendMessage call")
+SENDS = counter('telegram_sends_total', "Outbound messages by final result", ['result'])
+SEND_RETRIES = counter('telegram_send_retries_total', "Send attempts retried", ['reason'])
+SEND_QUEUE = gauge('telegram_send_queue', "Outbound messages waiting or being sent", ['state'])
+
+
+def timed_handler(callback: Callable, classify: Optional[Callable[[Any], str]] = None) -> Callable:
+    """Wrap an async handler callback to record its latency and errors.
+
+    `classify(update)` additionally files the latency under a callback type.
+    """
+    name = callback.__name__
+    seconds = HANDLER_SECONDS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            seconds.observe(elapsed)
+            if classify:
+                CALLBACK_SECONDS.labels(classify(update)).observe(elapsed)
+
+    return wrapper
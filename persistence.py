@@ -0,0 +1,166 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, List, MutableMapping, Optional
+import telegram
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Seconds between batched writes of changed user_data/conversation states
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '5'))
+
+# python-telegram-bot versions (from, to) whose ConversationHandler internals conversation_states() relies on
+PTB_SHARED_CONVERSATIONS = ((21, 0), (22, 0))
+
+
+def conversation_states(handler: ConversationHandler) -> MutableMapping:
+    """The live conversation states of `handler`.
+
+    PTB reads persisted conversations only once, at initialize (get_conversations), and
+    has no public way to reload them, so refreshing one goes through the handler's private
+    TrackingDict. This is the only place that touches it; the version is checked up front.
+    """
+    states = getattr(handler, '_conversations', None)
+    if not (hasattr(states, 'update_no_track') and hasattr(states, 'data')):
+        raise RuntimeError(f"ConversationHandler {handler.name!r} has no persistent states to refresh")
+    return states
+
+
+class PostgresPersistence(BasePersistence):
+    """Keeps user_data and ConversationHandler states in PostgreSQL.
+
+    Changes are buffered per user/conversation and written in one batch every
+    update_interval seconds. user_data is loaded lazily the first time a user
+    shows up after a restart, so startup does not read the whole table.
+
+    With shared=True several bot instances use the same tables: user_data is
+    reloaded on every update and refresh_conversations() reloads conversation
+    states, because another instance may have handled the user's last update.
+    """
+
+    def __init__(self, db: AsyncDatabase, update_interval: float = PERSISTENCE_INTERVAL, shared: bool = False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        low, high = PTB_SHARED_CONVERSATIONS
+        if shared and not low <= telegram.__version_info__[:2] < high:
+            raise RuntimeError(
+                f"Shared conversation state is untested with python-telegram-bot {telegram.__version__}; "
+                "check conversation_states() and update PTB_SHARED_CONVERSATIONS"
+            )
+        self.db = db
+        self.shared = shared
+        self._loaded_users = set()
+        self._dirty_users: Dict[int, Optional[Dict]] = {}
+        self._dirty_conversations: Dict[tuple, object] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        # Loaded per user in refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        if self.shared:
+            # Unwritten local changes are newer than the stored copy
+            if user_id in self._dirty_users:
+                return
+        elif user_id in self._loaded_users:
+            return
+        try:
+            stored = await self.db.load_user_data(user_id)
+        except Exception:
+            # Go on with what is in memory; the next update tries again
+            return
+        self._loaded_users.add(user_id)
+        if self.shared:
+            user_data.clear()
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        self._loaded_users.add(user_id)
+        self._dirty_users[user_id] = data
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int):
+        self._dirty_users[user_id] = None
+        self._schedule_flush()
+
+    async def get_conversations(self, name: str) -> Dict:
+        stored = await self.db.load_conversations(name)
+        return {tuple(json.loads(key)): state for key, state in stored.items()}
+
+    async def refresh_conversations(self, handlers: List[ConversationHandler], key: tuple):
+        """Replace the state of `key` in each persistent ConversationHandler with the stored one"""
+        serialized = json.dumps(list(key))
+        if any((handler.name, serialized) in self._dirty_conversations for handler in handlers):
+            return
+        stored = await self.db.load_conversation_states([handler.name for handler in handlers], serialized)
+        for handler in handlers:
+            name, states = handler.name, conversation_states(handler)
+            # Without tracking the write, so the state isn't persisted again
+            if name in stored:
+                states.update_no_track({key: stored[name]})
+            else:
+                states.data.pop(key, None)
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]):
+        self._dirty_conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        # The application hands over all changes of one interval back to back; write them together
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_dirty())
+
+    async def _write_dirty(self):
+        await asyncio.sleep(0)
+        user_data, self._dirty_users = self._dirty_users, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        if not user_data and not conversations:
+            return
+        try:
+            await self.db.save_bot_state(user_data, conversations)
+        except Exception:
+            # Keep the batch for the next run, unless something newer replaced it meanwhile
+            for user_id, data in user_data.items():
+                self._dirty_users.setdefault(user_id, data)
+            for key, state in conversations.items():
+                self._dirty_conversations.setdefault(key, state)
+
+    async def flush(self):
+        if self._flush_task:
+            await self._flush_task
+        await self._write_dirty()
+
+    # Not stored
+    async def get_chat_data(self) -> Dict:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
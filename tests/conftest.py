@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+
+# The bot's modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests that need PostgreSQL run against this database; its tables are created and written to
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+
+@pytest.fixture(scope='session')
+def db():
+    """A migrated Database on TEST_DATABASE_URL"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    from database import Database
+    database = Database()
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def users(db):
+    """Two approved users; deleting them afterwards removes their messages too"""
+    user_ids = (990_000_001, 990_000_002)
+    for user_id in user_ids:
+        db.delete_user(user_id)
+        db.add_user(user_id, 'Test', str(user_id))
+        db.approve_user(user_id)
+    yield user_ids
+    for user_id in user_ids:
+        db.delete_user(user_id)
@@ -0,0 +1,112 @@
+import random
+
+# get_thread_starter before messages stored their root: walk thread_id up to the message with no parent
+RECURSIVE_THREAD_STARTER = """
+    WITH RECURSIVE thread_chain AS (
+        SELECT message_id, thread_id
+        FROM messages
+        WHERE message_id = %s
+
+        UNION ALL
+
+        SELECT m.message_id, m.thread_id
+        FROM messages m
+        INNER JOIN thread_chain tc ON m.message_id = tc.thread_id
+    )
+    SELECT message_id FROM thread_chain
+    WHERE thread_id IS NULL
+    LIMIT 1
+"""
+
+
+def recursive_root(db, message_id):
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(RECURSIVE_THREAD_STARTER, (message_id,))
+            row = cur.fetchone()
+            return row['message_id'] if row else message_id
+
+
+def assert_roots_match(db, message_ids):
+    for message_id in message_ids:
+        expected = recursive_root(db, message_id)
+        message = db.get_message(message_id)
+        assert message['root_id'] == expected
+        assert db.get_thread_starter(message_id) == expected
+        assert db.get_thread_starter(message_id, message['created_at']) == expected
+
+
+def test_new_message_is_its_own_root(db, users):
+    alice, bob = users
+    message_id = db.save_message(alice, bob, 'hello')
+    assert db.get_message(message_id)['root_id'] == message_id
+    assert db.get_thread_starter(message_id) == message_id
+
+
+def test_reply_chain_matches_recursive_walk(db, users):
+    alice, bob = users
+    root = db.save_message(alice, bob, 'root')
+    # Each message replies to the one before it
+    chain = [root]
+    for depth in range(6):
+        sender, recipient = (bob, alice) if depth % 2 == 0 else (alice, bob)
+        chain.append(db.save_message(sender, recipient, f'reply {depth}', chain[-1]))
+    # Two more replies branching off the middle of the chain, one of them answered again
+    branch = db.save_message(alice, bob, 'branch', chain[3])
+    reply_to_reply = db.save_message(bob, alice, 'reply to a reply', branch)
+    second_branch = db.save_message(bob, alice, 'second branch', chain[3])
+
+    messages = chain + [branch, reply_to_reply, second_branch]
+    assert_roots_match(db, messages)
+    assert {db.get_message(message_id)['root_id'] for message_id in messages} == {root}
+
+
+def test_random_threads_match_recursive_walk(db, users):
+    rand = random.Random(4)
+    messages = []
+    for i in range(60):
+        # About a third start a new thread; the rest answer any earlier message
+        parent = rand.choice(messages) if messages and rand.random() > 0.3 else None
+        messages.append(db.save_message(*rand.sample(users, 2), f'message {i}', parent))
+    assert_roots_match(db, messages)
+
+
+def test_batch_matches_recursive_walk(db, users):
+    alice, bob = users
+    root = db.save_message(alice, bob, 'root')
+    reply = db.save_message(bob, alice, 'reply', root)
+    # Parents committed before the batch, at several depths, mixed with new threads
+    batch = db.save_messages([
+        (alice, bob, 'new thread', None),
+        (alice, bob, 'reply to root', root),
+        (alice, bob, 'reply to a reply', reply),
+        (bob, alice, 'another new thread', None),
+    ])
+    later = db.save_messages([(bob, alice, 'reply to a batched reply', batch[2])])
+    assert_roots_match(db, [root, reply] + batch + later)
+    assert db.get_message(batch[0])['root_id'] == batch[0]
+    assert db.get_message(later[0])['root_id'] == root
+
+
+def test_reply_to_missing_parent_stays_in_its_thread(db, users):
+    alice, bob = users
+    # The parent's partition was archived: the reply joins the thread its parent named
+    missing = 2_000_000_000
+    assert db.get_message(missing) is None
+    message_id = db.save_message(alice, bob, 'late reply', missing)
+    batched = db.save_messages([(bob, alice, 'late batched reply', missing)])[0]
+    assert db.get_message(message_id)['root_id'] == missing
+    assert db.get_message(batched)['root_id'] == missing
+
+
+def test_known_root_is_stored_without_reading_the_parent(db, users):
+    alice, bob = users
+    root = db.save_message(alice, bob, 'root')
+    reply = db.save_message(bob, alice, 'reply', root, root_id=root)
+    # The caller's root wins even where a parent lookup would find something else
+    batch = db.save_messages([
+        (alice, bob, 'batched reply', reply, root),
+        (alice, bob, 'reply with a stated root', 2_000_000_000, root),
+        (bob, alice, 'looked up', reply),
+    ])
+    assert [db.get_message(message_id)['root_id'] for message_id in [reply] + batch] == [root] * 4
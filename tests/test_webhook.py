@@ -0,0 +1,88 @@
+import json
+import asyncio
+from telegram import Update
+from telegram.ext import Application
+from bot import TainaPoshtaBot
+from webserver import HTTPServer
+
+SECRET = 'test-secret'
+PATH = '/telegram'
+
+UPDATE = {
+    'update_id': 1001,
+    'message': {
+        'message_id': 7,
+        'date': 1_700_000_000,
+        'chat': {'id': 42, 'type': 'private'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+        'text': '/start',
+    },
+}
+
+
+async def post(port: int, body: bytes, secret: bytes):
+    """POST `body` to the webhook path; returns the status code"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(
+        f"POST {PATH} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n".encode()
+        + b"X-Telegram-Bot-Api-Secret-Token: " + secret + b"\r\n\r\n" + body
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+def run_webhook(requests):
+    """Serve the bot's webhook handler on a free port, send (body, secret) requests and
+    return their statuses and the updates that were queued"""
+    async def main():
+        # Only the parts of the bot the webhook handler uses; no database or Telegram connection
+        bot = TainaPoshtaBot.__new__(TainaPoshtaBot)
+        bot.application = Application.builder().token('123:TEST').build()
+        bot.webhook_secret = SECRET
+        server = HTTPServer('127.0.0.1', 0)
+        server.route('POST', PATH, bot.webhook_handler)
+        await server.start()
+        try:
+            statuses = [await post(server.port, body, secret) for body, secret in requests]
+        finally:
+            await server.stop()
+        queue = bot.application.update_queue
+        return statuses, [queue.get_nowait() for _ in range(queue.qsize())]
+
+    return asyncio.run(main())
+
+
+def test_update_with_secret_is_queued():
+    statuses, updates = run_webhook([(json.dumps(UPDATE).encode(), SECRET.encode())])
+    assert statuses == [200]
+    assert len(updates) == 1
+    assert isinstance(updates[0], Update)
+    assert updates[0].update_id == 1001
+    assert updates[0].message.text == '/start'
+
+
+def test_wrong_secret_is_forbidden():
+    body = json.dumps(UPDATE).encode()
+    statuses, updates = run_webhook([
+        (body, b'wrong'),
+        (body, b''),
+        # Not ASCII: must be a mismatch, not a server error
+        (body, 'секрет'.encode()),
+    ])
+    assert statuses == [403, 403, 403]
+    assert updates == []
+
+
+def test_malformed_update_is_rejected():
+    statuses, updates = run_webhook([
+        (b'not json', SECRET.encode()),
+        (b'[1, 2]', SECRET.encode()),
+        (b'null', SECRET.encode()),
+        (b'\xff\xfe', SECRET.encode()),
+    ])
+    assert statuses == [400, 400, 400, 400]
+    assert updates == []
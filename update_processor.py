@@ -0,0 +1,84 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from metrics import STARTUP_SECONDS, UPDATE_SECONDS, UPDATES, UPDATES_IN_PROGRESS, process_uptime
+
+logger = logging.getLogger(__name__)
+
+# Updates processed at the same time across all users
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different users in parallel, but one user's updates one at a time.
+
+    A user's `select` button press and the message that follows both touch
+    context.user_data, so they must not overlap. BaseUpdateProcessor admits at
+    most `max_concurrent_updates` updates at once; each admitted update then
+    waits on a per-user lock (FIFO, so arrival order is kept). Updates queued
+    behind their user's lock count towards that limit while they wait.
+    """
+
+    def __init__(self, max_concurrent_updates: int = CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+        self._first_update_done = False
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        key = self._key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            # Forget the lock once nobody holds or waits for it
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]):
+        UPDATES_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            await coroutine
+            status = 'ok'
+            if not self._first_update_done:
+                # Time-to-first-response after a (cold) start
+                self._first_update_done = True
+                uptime = process_uptime()
+                STARTUP_SECONDS.labels('first_update').set(uptime)
+                logger.info(f"First update handled {uptime:.2f}s after process start")
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started)
+            UPDATES_IN_PROGRESS.dec()
+            UPDATES.labels(status).inc()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Requests larger than this are rejected (Telegram updates are a few KB)
+MAX_BODY_SIZE = 1024 * 1024
+# Seconds to wait for a client to send the next request line/headers/body
+READ_TIMEOUT = 30
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+class Request:
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    def __init__(self, status: int = 200, body: bytes = b'', content_type: str = 'text/plain; charset=utf-8'):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HTTPServer:
+    """Minimal asyncio HTTP/1.1 server for the webhook and service endpoints"""
+
+    def __init__(self, host: str, port: int, max_connections: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._server = None
+        self._slots = asyncio.Semaphore(max_connections) if max_connections else None
+
+    def route(self, method: str, path: str, handler: Handler):
+        """Register an async handler for an exact method and path"""
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        sockets = self._server.sockets or []
+        if sockets and not self.port:
+            # Port 0 asks the OS for a free port
+            self.port = sockets[0].getsockname()[1]
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            logger.info("HTTP server stopped")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self._slots:
+            await self._slots.acquire()
+        try:
+            # Keep-alive: serve requests until the client closes or asks to
+            while True:
+                request, error = await self._read_request(reader)
+                if request is None and error is None:
+                    break
+                response = error or await self._dispatch(request)
+                keep_alive = request is not None and request.headers.get('connection', '').lower() != 'close'
+                await self._write_response(writer, response, keep_alive and error is None)
+                if not keep_alive or error is not None:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Error handling HTTP connection: {e}")
+        finally:
+            if self._slots:
+                self._slots.release()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """Return (request, None), (None, error response) or (None, None) on a closed connection"""
+        request_line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+        if not request_line:
+            return None, None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            return None, Response(400, b'Malformed request line')
+
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            return None, Response(400, b'Invalid Content-Length')
+        if length > MAX_BODY_SIZE:
+            return None, Response(413)
+        body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b''
+
+        path = target.split('?', 1)[0]
+        return Request(method.upper(), path, headers, body), None
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return Response(405)
+            return Response(404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error in HTTP handler for {request.method} {request.path}: {e}")
+            return Response(500)
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        body = response.body if response.body else STATUS_TEXT.get(response.status, '').encode()
+        head = (
+            f"HTTP/1.1 {response.status} {STATUS_TEXT.get(response.status, 'Unknown')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()